@@ -27,7 +27,7 @@ from itools.core import proto_lazy_property, proto_property
 from itools.datatypes import Date, Integer
 from itools.gettext import MSG
 from itools.ical import Time
-from itools.database import AndQuery, PhraseQuery, NotQuery
+from itools.database import AndQuery, PhraseQuery, NotQuery, RangeQuery
 from itools.stl import stl
 from itools.web import BaseView, STLView, INFO, ERROR, get_context
 
@@ -296,6 +296,8 @@ class CalendarCaptionTemplate(CMSTemplate):
 class CalendarView(STLView):
 
     query_schema = {'start': Date}
+    # Without a start date, the calendar shows the current date
+    cache_output = False
 
     styles = ['/ui/agenda/style.css',
               '/ui/js/fancybox/jquery.fancybox-1.3.4.css',
@@ -381,24 +383,60 @@ class CalendarView(STLView):
     ######################################################################
     # Public API
     ######################################################################
-    def get_events(self, day=None, *args):
-        query = AndQuery(*args)
-        query.append(PhraseQuery('base_classes', 'event'))
-        if day:
-            query.append(PhraseQuery('dates', day))
-
-        # Do not show hidden calendars
-        context = get_context()
+    @proto_lazy_property
+    def hidden_calendars(self):
+        """Returns the list of queries excluding the calendars hidden by the
+        user, it is computed once per request.
+        """
+        context = self.context
+        queries = []
         for calendar in context.search(format='calendar').get_resources():
             if context.user.name in calendar.get_value('hidden_for_users'):
                 abspath = str(calendar.abspath)
-                query.append(NotQuery(PhraseQuery('calendar', abspath)))
+                queries.append(NotQuery(PhraseQuery('calendar', abspath)))
+        return queries
 
-        # Ok
+
+    def get_events(self, day=None, *args):
+        if day:
+            return self.get_events_by_day(day, day, *args)[day]
+
+        query = AndQuery(*args)
+        query.append(PhraseQuery('base_classes', 'event'))
+        for hidden in self.hidden_calendars:
+            query.append(hidden)
         search = self.context.search(query)
         return search.get_resources(sort_by='dtstart')
 
 
+    def get_events_by_day(self, start, end, *args):
+        """Returns a dict mapping every day from start to end (included) to
+        the list of events occurring that day.  The events are fetched with
+        a single search, and the recurrences are expanded for the given
+        window only.
+        """
+        query = AndQuery(*args)
+        query.append(PhraseQuery('base_classes', 'event'))
+        query.append(RangeQuery('event_start', None, end))
+        query.append(RangeQuery('event_end', start, None))
+        for hidden in self.hidden_calendars:
+            query.append(hidden)
+
+        # Bucket the events per day
+        days = {}
+        day = start
+        while day <= end:
+            days[day] = []
+            day += timedelta(1)
+
+        search = self.context.search(query)
+        for event in search.get_resources(sort_by='dtstart'):
+            for day in event.get_dates((start, end)):
+                days[day].append(event)
+
+        return days
+
+
     def get_namespace(self, resource, context):
         c_date = self.get_current_date(context)
         cal_selector = self.calendar_selector(context=context, c_date=c_date)
@@ -457,6 +495,8 @@ class MultiweekView(CalendarView):
         # Get the 5 weeks
         namespace['weeks'] = []
         link = ';new_event?dtstart={date}&dtend={date}'
+        end = start + timedelta(nweeks * 7 - 1)
+        events = self.get_events_by_day(start, end)
         day = start
         for kk in range(nweeks):
             ns_week = []
@@ -475,7 +515,7 @@ class MultiweekView(CalendarView):
                     if with_new_url:
                         ns_day['url'] = link.format(date=Date.encode(day))
                     # Get a list of events to display on view
-                    for event in self.get_events(day):
+                    for event in events[day]:
                         ns_day['events'].append(
                           {'stream': event.render(event=event, day=day),
                            'color': event.get_color(),
@@ -549,11 +589,15 @@ class WeeklyView(CalendarView):
         if headers is None:
             headers = [None] * ndays
 
+        # Get the events of the whole window at once
+        end = current_date + step * (len(headers) - 1)
+        events = self.get_events_by_day(current_date, end)
+
         # Get a list of events to display on view
         for header in headers:
             # Insert events
             ns_events = []
-            for event in self.get_events(current_date):
+            for event in events.get(current_date, []):
                 n = event.get_ns_event(current_date, grid=True)
                 n['stream'] = event.render(event=event, day=current_date)
                 ns_events.append(n)
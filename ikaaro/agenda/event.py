@@ -44,7 +44,7 @@ from ikaaro import messages
 # Import from calendar
 from calendars import Calendars_Enumerate
 from recurrence import RRule_Field, RRuleInterval_Field, RRuleUntil_Field
-from recurrence import get_dates
+from recurrence import get_dates, get_last_date
 from reminders import Reminder_Field
 
 
@@ -360,7 +360,7 @@ class Event(Content):
             self.set_value('uid', uid)
 
 
-    def get_dates(self):
+    def _get_start_end(self):
         start = self.get_value('dtstart')
         if type(start) is datetime:
             start = start.date()
@@ -369,9 +369,19 @@ class Event(Content):
         if type(end) is datetime:
             end = end.date()
 
+        return start, end
+
+
+    def get_dates(self, window=None):
+        """Returns the sorted list of days the event occurs on.  If the
+        window, a tuple (first, last), is given, only the days within it
+        are computed.
+        """
+        start, end = self._get_start_end()
+
         # Recurrence
         rrule = self.metadata.get_property('rrule')
-        dates = get_dates(start, end, rrule)
+        dates = get_dates(start, end, rrule, window)
         # Exclude dates
         exdate = self.get_value('exdate')
         dates.difference_update(exdate)
@@ -379,6 +389,16 @@ class Event(Content):
         return sorted(dates)
 
 
+    def get_date_range(self):
+        """Returns the first and the last days the event may occur on, the
+        last day is 'date.max' if the recurrence has no end.
+        """
+        start, end = self._get_start_end()
+        rrule = self.metadata.get_property('rrule')
+        last = get_last_date(start, end, rrule)
+        return start, last or date.max
+
+
     def get_value(self, name, language=None):
         if name in ('rrule_interval', 'rrule_byday', 'rrule_until'):
             f_name, kk, param = name.partition('_')
@@ -397,7 +417,8 @@ class Event(Content):
 
     def get_catalog_values(self):
         values = super(Event, self).get_catalog_values()
-        values['dates'] = self.get_dates()
+        # The occurrences are computed when needed, only for the days shown
+        values['event_start'], values['event_end'] = self.get_date_range()
         return values
 
 
@@ -531,4 +552,5 @@ class EventModel(Model):
 
 
 # Register
-register_field('dates', Date(indexed=True, multiple=True))
+register_field('event_start', Date(indexed=True, stored=True))
+register_field('event_end', Date(indexed=True, stored=True))
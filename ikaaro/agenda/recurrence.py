@@ -62,10 +62,21 @@ rrules = {
     'yearly': next_year}
 
 
-def get_dates(start, end, rrule):
+def get_dates(start, end, rrule, window=None):
+    """Returns the set of days the event occurs on.  If the window, a tuple
+    (first, last), is given, only the days within it are returned and the
+    recurrence is expanded up to the last day of the window.
+    """
     dates = set()
     days = range((end - start).days + 1)
-    f = lambda date: dates.update([ date + timedelta(x) for x in days ])
+    if window:
+        first, last = window
+
+    def f(date):
+        for x in days:
+            day = date + timedelta(x)
+            if window is None or first <= day <= last:
+                dates.add(day)
 
     # Case 1: No recurrence rule
     if not rrule or not rrule.value:
@@ -83,6 +94,10 @@ def get_dates(start, end, rrule):
     until = rrule.get_parameter('until')
     if until:
         until += timedelta(1)
+        if window:
+            until = min(until, last + timedelta(1))
+    elif window:
+        until = last + timedelta(1)
     else:
         until = max(start, date.today()) + MAX_DELTA
 
@@ -113,6 +128,20 @@ def get_dates(start, end, rrule):
 
 
 
+def get_last_date(start, end, rrule):
+    """Returns the last day the event may occur on, or None if the
+    recurrence has no end.
+    """
+    if not rrule or not rrule.value:
+        return end
+
+    until = rrule.get_parameter('until')
+    if not until:
+        return None
+    return until + (end - start)
+
+
+
 ###########################################################################
 # Datatypes, Widgets and Fields
 ###########################################################################
@@ -14,12 +14,16 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+# Import from the Standard Library
+from json import dumps
+
 # Import from itools
 from itools.core import proto_lazy_property, is_prototype
+from itools.database import OrQuery, PhraseQuery, StartQuery, TextQuery
 from itools.datatypes import DateTime, Enumerate, String, Time, Unicode, URI
 from itools.gettext import MSG
 from itools.handlers import checkid
-from itools.web import get_context, ERROR, FormError
+from itools.web import BaseView, get_context, ERROR, FormError
 
 # Import from ikaaro
 from autoform import AutoForm, HiddenWidget, ReadOnlyWidget, SelectWidget
@@ -28,49 +32,120 @@ from datatypes import Days, Months, Years
 from buttons import Button
 from fields import Field
 import messages
-from utils import get_content_containers, make_stl_template
+from utils import get_content_containers_query, make_stl_template
 
 
 
 class Location_Datatype(Enumerate):
 
-    def get_options(cls):
+    # Above this number of locations the widget does type-ahead
+    max_options = 100
+
+    def get_search(cls):
         context = get_context()
         class_id = context.query['type']
+        query = get_content_containers_query(context, class_id)
+        return context.search(query)
+
+
+    def get_options(cls):
+        search = cls.get_search()
+        resources = search.get_resources(sort_by='abspath',
+                                         size=cls.max_options)
 
         items = []
-        for resource in get_content_containers(context, class_id):
+        for resource in resources:
             path = resource.abspath
             title = '/' if not path else ('%s/' % path)
             items.append({'name': path, 'value': title, 'selected': False})
-
-        # Sort
-        items.sort(key=lambda x: x['name'])
         return items
 
 
+    def is_valid(cls, value):
+        # With type-ahead not all the locations are options, the location
+        # is checked against the catalog by 'AutoAdd.get_container'
+        return True
+
+
 
 class Location_Widget(SelectWidget):
     """This widget is only used in add forms. It is a hack because it is a
     composite widget and ikaaro does not allow to do this easily.
+
+    When there are too many locations to choose from, it is a text input
+    with type-ahead (see 'Location_Search').
     """
 
     title = MSG(u'Location')
 
     template = make_stl_template("""
-    <select id="${id}" name="${name}" class="${css}">
+    <select id="${id}" name="${name}" class="${css}" stl:if="not typeahead">
       <option stl:repeat="option options" value="${option/name}"
         selected="${option/selected}">${option/value}</option>
     </select>
+    <stl:block stl:if="typeahead">
+      <input type="text" id="${id}" name="${name}" value="${value}"
+        list="${id}-list" autocomplete="off" size="40" class="${css}"/>
+      <datalist id="${id}-list"></datalist>
+      <script type="text/javascript">
+        $("#${id}").keyup(function() {
+          var query = {type: "${class_id}", term: $(this).val()};
+          $.getJSON(";location_search", query, function(data) {
+            var list = $("#${id}-list").empty();
+            $.each(data, function(i, path) {
+              var option = $(document.createElement("option"));
+              list.append(option.attr("value", path));
+            });
+          });
+        });
+      </script>
+    </stl:block>
     <input type="text" id="name" name="name" value="${name_value}"
       maxlength="80" size="40" style="width: 50%" />
     """)
 
+    @proto_lazy_property
+    def typeahead(self):
+        return len(self.datatype.get_search()) > self.datatype.max_options
+
+
+    def class_id(self):
+        return get_context().query['type']
+
+
     def name_value(self):
         return get_context().query['name']
 
 
 
+class Location_Search(BaseView):
+    """Returns the locations matching the given term, as a JSON list of
+    paths, for the type-ahead of the location widget.
+    """
+
+    access = 'is_allowed_to_view'
+    query_schema = {'type': String, 'term': Unicode}
+    size = 20
+
+    def GET(self, resource, context):
+        class_id = context.query['type'] or None
+        query = get_content_containers_query(context, class_id)
+
+        term = context.query['term'].strip()
+        if term.startswith('/'):
+            term = term.rstrip('/') or '/'
+            query.append(StartQuery('abspath', term.encode('utf-8')))
+        elif term:
+            query.append(OrQuery(TextQuery('title', term),
+                                 StartQuery('name', term.encode('utf-8'))))
+
+        search = context.search(query)
+        resources = search.get_resources(sort_by='abspath', size=self.size)
+        context.content_type = 'application/json'
+        return dumps([ str(x.abspath) for x in resources ])
+
+
+
 class Location_Field(Field):
 
     datatype = Location_Datatype
@@ -243,17 +318,26 @@ class AutoAdd(AutoForm):
     def get_container(self, resource, context, form):
         # Container
         container = resource
+        class_id = context.query['type']
         if 'location' in self.get_fields():
             path = form['location']
             if path is not None:
-                container = resource.get_resource(path)
+                container = resource.get_resource(path, soft=True)
+                # The location must be a content folder that accepts the
+                # class (see 'Location_Datatype')
+                if container is not None:
+                    query = get_content_containers_query(context, class_id)
+                    abspath = str(container.abspath)
+                    query.append(PhraseQuery('abspath', abspath))
+                    if len(context.search(query)) == 0:
+                        container = None
         else:
             path = str(container.abspath)
 
         # Access control
-        class_id = context.query['type']
         root = context.root
-        if not root.has_permission(context.user, 'add', container, class_id):
+        if container is None or not root.has_permission(context.user, 'add',
+                                                         container, class_id):
             path = '/' if path == '.' else '/%s/' % path
             msg = ERROR(u'Adding resources to {path} is not allowed.')
             raise FormError, msg.gettext(path=path)
@@ -20,7 +20,7 @@ from operator import itemgetter
 # Import from itools
 from itools.core import freeze, proto_property
 from itools.csv import Property
-from itools.database import Resource
+from itools.database import OrQuery, PhraseQuery, Resource
 from itools.datatypes import Email, Enumerate, MultiLinesTokens
 from itools.datatypes import String
 from itools.gettext import MSG
@@ -641,38 +641,65 @@ class Observable(Resource):
 #       if not context.database.is_changed(self):
 #           return
 
-        # 2. Get list of subscribed users
-        users = self.get_subscribed_users()
-        if not users:
-            return
+        # 2. Get the emails of the subscribers, by language
+        subscribers = self.get_subscribers_by_language(context)
 
-        # 3. Build the message for each language
+        # 3. Send the message, once for every language
         root = context.root
-        website_languages = root.get_value('website_languages')
-        default_language = root.get_default_language()
-        messages_dict = {}
-        for language in website_languages:
-            messages_dict[language] = self.get_message(context, language)
+        for language, emails in subscribers.iteritems():
+            subject, body = self.get_message(context, language)
+            root.send_bulk_email(emails, subject, text=body)
 
-        # 4. Send the message
-        auth_user = context.user.name if context.user else None
 
+    def get_subscribers_by_language(self, context):
+        """Returns the dict {language: [email, ...]} of the active users
+        subscribed, but the authenticated user.  The users are read from
+        the catalog, but for the users changed in the current transaction.
+        """
+        users = set(self.get_subscribed_users())
+        if context.user:
+            users.discard(context.user.name)
+        if not users:
+            return {}
+
+        # Read the users from the catalog
+        root = context.root
+        database = context.database
+        query = [ PhraseQuery('abspath', '/users/%s' % x) for x in users ]
+        values = {}
+        for brain in database.search(OrQuery(*query)).get_documents():
+            value = (brain.email, brain.user_state, brain.user_language)
+            # Catalogs made by older versions do not store these fields, the
+            # user is read instead
+            if None not in value:
+                values[brain.name] = value
+
+        # Not yet indexed
+        users_key = root.get_resource('users').handler.key
+        resolve = database.fs.resolve2
         for username in users:
-            if username == auth_user:
-                continue
-            # Not confirmed yet
-            if self.get_register_key(username) is not None:
+            key = resolve(users_key, '%s.metadata' % username)
+            if username in values and not database.has_changes(key):
                 continue
             user = root.get_user(username)
-            if user and user.get_value('user_state') == 'active':
-                mail = user.get_value('email')
-
-                language = user.get_value('user_language')
-                if language not in website_languages:
-                    language = default_language
-                subject, body = messages_dict[language]
-
-                root.send_email(mail, subject, text=body)
+            if user is None:
+                values.pop(username, None)
+            else:
+                values[username] = (user.get_value('email'),
+                                    user.get_value('user_state'),
+                                    user.get_value('user_language'))
+
+        # Group by language
+        website_languages = root.get_value('website_languages')
+        default_language = root.get_default_language()
+        subscribers = {}
+        for email, state, language in values.itervalues():
+            if not email or state != 'active':
+                continue
+            if language not in website_languages:
+                language = default_language
+            subscribers.setdefault(language, []).append(email)
+        return subscribers
 
 
     #######################################################################
@@ -30,8 +30,8 @@ from itools.database import PhraseQuery
 # Import from ikaaro
 from folder import Folder
 from folder_views import Folder_BrowseContent
+from links import link_graph_cache
 from messages import MSG_CHANGES_SAVED
-from utils import get_base_path_query
 
 
 ###########################################################################
@@ -113,21 +113,14 @@ class Config_BrokenLinks(STLView):
     def get_namespace(self, resource, context):
         # Find out broken links
         base = resource.abspath
+        graph = link_graph_cache.get_graph(context.database)
 
         # Search only within the given resource
-        query = get_base_path_query(base, min_depth=0)
-        results = context.search(query)
-
-        # Find out the broken links
-        root = context.root
+        prefix = '%s/' % base if base else '/'
         broken = {}
-        for link in context.database.catalog.get_unique_values('links'):
-            if root.get_resource(link, soft=True) is not None:
-                continue
-            sub_results = results.search(PhraseQuery('links', link))
-            link = str(base.get_pathto(Path(link)))
-            for brain in sub_results.get_documents():
-                broken.setdefault(brain.abspath, []).append(link)
+        for path, links in graph.broken_links.iteritems():
+            if path == str(base) or path.startswith(prefix):
+                broken[path] = [ str(base.get_pathto(Path(x))) for x in links ]
 
         # Build the namespace
         items = []
@@ -168,19 +161,41 @@ class Config_Orphans(Folder_BrowseContent):
         # Make the base search
         items = super(Config_Orphans, self).get_items(context.root, context)
 
-        # Show only the orphan resources
-        items = [ x for x in items.get_documents()
-                  if len(context.database.search(links=x.abspath)) == 0 ]
-
-        # Transform back the items found in a SearchResults object.
-        # FIXME This is required by 'get_item_value', we should change that,
-        # for better performance.
-        args = [ PhraseQuery('abspath', x.abspath) for x in items ]
-        query = OrQuery(*args)
-        items = context.search(query)
+        # Show only the orphan resources, searched by pages of abspaths
+        graph = link_graph_cache.get_graph(context.database)
+        orphans = sorted(graph.orphans)
+        documents = []
+        for n in range(0, len(orphans), 200):
+            query = [ PhraseQuery('abspath', x) for x in orphans[n:n+200] ]
+            documents.extend(items.search(OrQuery(*query)).get_documents())
 
         # Ok
-        return items
+        return documents
+
+
+    def sort_and_batch(self, resource, context, results):
+        start = context.query['batch_start']
+        size = context.query['batch_size']
+        sort_by = context.query['sort_by']
+        reverse = context.query['reverse']
+
+        # Sort
+        if sort_by is not None:
+            get_key = getattr(self, 'get_key_sorted_by_' + sort_by, None)
+            if get_key is None:
+                # The stored values
+                key = lambda x: getattr(x, sort_by, None)
+            else:
+                key = get_key()
+            results.sort(key=key, reverse=reverse)
+
+        # Batch
+        if size:
+            results = results[start:start+size]
+        elif start:
+            results = results[start:]
+        database = resource.database
+        return [ database.get_resource(x.abspath) for x in results ]
 
 
 
@@ -15,7 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # Import from itools
-from itools.core import freeze, is_prototype, proto_property
+from itools.core import LRUCache, freeze, is_prototype, proto_property
 from itools.database import AllQuery, AndQuery, OrQuery, PhraseQuery
 from itools.datatypes import Enumerate
 from itools.gettext import MSG
@@ -28,12 +28,13 @@ from autoedit import AutoEdit
 from buttons import Remove_BrowseButton
 from config import Configuration
 from config_common import NewResource_Local
+from database import register_commit_hook
 from enumerates import Groups_Datatype
 from fields import Select_Field
 from folder import Folder
 from folder_views import Folder_BrowseContent
 from resource_ import DBResource
-from utils import get_base_path_query
+from utils import PathTrie, get_base_path_query
 
 
 ###########################################################################
@@ -188,6 +189,166 @@ class AccessRule(DBResource):
 
 
 
+###########################################################################
+# Compiled access rules
+###########################################################################
+class AccessRules(object):
+    """The access rules compiled into an in-memory structure: for every
+    pair (group, permission) the rules are kept in a trie indexed by their
+    path.  It answers whether a resource is allowed from the resource
+    itself (path, share, owner and format), without searching the catalog,
+    and builds the search queries equivalent to the rules.
+    """
+
+    def __init__(self, rules):
+        self.tries = {}
+        self.queries = {}
+        for rule in rules:
+            key = rule.get_value('group'), rule.get_value('permission')
+            trie = self.tries.get(key)
+            if trie is None:
+                trie = self.tries[key] = PathTrie()
+                self.queries[key] = []
+
+            path = rule.get_value('search_path')
+            if path:
+                depth = rule.get_value('search_path_depth')
+                depth = None if depth == '*' else int(depth)
+            else:
+                path, depth = '/', None
+            format = rule.get_value('search_format') or None
+            trie.add(path, (depth, format))
+            self.queries[key].append((format, rule.get_search_query()))
+
+
+    def get_rules_query(self, user_groups, permission, class_id=None):
+        query = OrQuery()
+        for group in user_groups:
+            rules = self.queries.get((group, permission), [])
+            for format, rule_query in rules:
+                if permission == 'add':
+                    if class_id and format and class_id != format:
+                        continue
+                query.append(rule_query)
+
+        return query
+
+
+    def match_rules(self, user_groups, permission, resource, class_id=None):
+        # With the 'add' permission the format of the rule filters the
+        # class of the new resource, not the format of the container
+        if permission == 'add':
+            format = class_id
+        else:
+            format = resource.metadata.format
+
+        abspath = resource.abspath
+        for group in user_groups:
+            trie = self.tries.get((group, permission))
+            if trie is None:
+                continue
+
+            for distance, (depth, r_format) in trie.get_matches(abspath):
+                if depth is not None and distance > depth:
+                    continue
+                if format and r_format and format != r_format:
+                    continue
+                return True
+
+        return False
+
+
+    def has_permission(self, user, user_groups, permission, resource,
+                       class_id=None):
+        """Same as searching the query returned by
+        'ConfigAccess.get_search_query' for the given resource.
+        """
+        match = self.match_rules(user_groups, permission, resource, class_id)
+        share = resource.get_share() or []
+
+        # Case: anonymous
+        if not user:
+            return match and 'everybody' in share
+
+        # Case: authenticated
+        userid = str(user.abspath)
+        if permission != 'share' and resource.get_owner() == userid:
+            return True
+        if not match:
+            return False
+        return userid in share or not user_groups.isdisjoint(share)
+
+
+
+###########################################################################
+# Permissions cache
+###########################################################################
+class AccessCache(object):
+    """Cache of the decisions taken by 'ConfigAccess.has_permission'.
+
+    Decisions are grouped by the abspath of the resource, so they can be
+    dropped when the resource changes (its share, owner or format may have
+    changed).  Everything is dropped when the access rules change.  The
+    user groups are part of the key, so changing the groups of a user does
+    not require to invalidate anything.
+    """
+
+    def __init__(self, size_min=4800, size_max=5200):
+        self.decisions = LRUCache(size_min, size_max)
+        self.rules = None
+        self.hits = 0
+        self.misses = 0
+
+
+    def get_key(self, user, user_groups, permission, class_id):
+        userid = str(user.abspath) if user else None
+        return userid, frozenset(user_groups), permission, class_id
+
+
+    def get(self, abspath, key):
+        decisions = self.decisions.get(abspath)
+        if decisions is not None and key in decisions:
+            self.hits += 1
+            return decisions[key]
+
+        self.misses += 1
+        return None
+
+
+    def set(self, abspath, key, value):
+        decisions = self.decisions.get(abspath)
+        if decisions is None:
+            decisions = self.decisions[abspath] = {}
+        decisions[key] = value
+
+
+    def clear(self):
+        self.decisions.clear()
+        self.rules = None
+
+
+    def get_stats(self):
+        return {'size': len(self.decisions), 'hits': self.hits,
+                'misses': self.misses}
+
+
+    def on_commit(self, database, paths):
+        for path in paths:
+            if path == '/config/access' or path.startswith('/config/access/'):
+                self.clear()
+                return
+
+        decisions = self.decisions
+        for path in paths:
+            if path in decisions:
+                del decisions[path]
+
+
+access_cache = AccessCache()
+register_commit_hook(access_cache.on_commit)
+
+
+
 ###########################################################################
 # Configuration module
 ###########################################################################
@@ -329,6 +490,13 @@ class ConfigAccess(Folder):
         return user_groups, '/config/groups/admins' in user_groups
 
 
+    def get_access_rules(self):
+        rules = access_cache.rules
+        if rules is None:
+            rules = access_cache.rules = AccessRules(self.get_resources())
+        return rules
+
+
     def get_search_query(self, user, permission, class_id=None):
         # Special case: admins can see everything
         user_groups, is_admin = self._get_user_groups(user)
@@ -336,20 +504,9 @@ class ConfigAccess(Folder):
             return AllQuery()
 
         # 1. Back-office access rules
-        rules_query = OrQuery()
-        for rule in self.get_resources():
-            if rule.get_value('permission') != permission:
-                continue
-
-            if rule.get_value('group') not in user_groups:
-                continue
-
-            if permission == 'add':
-                r_format = rule.get_value('search_format')
-                if class_id and r_format and class_id != r_format:
-                    continue
-
-            rules_query.append(rule.get_search_query())
+        rules = self.get_access_rules()
+        rules_query = rules.get_rules_query(user_groups, permission,
+                                            class_id)
 
         # Case: anonymous
         if not user:
@@ -368,14 +525,33 @@ class ConfigAccess(Folder):
 
 
     def has_permission(self, user, permission, resource, class_id=None):
-        # The query
-        query = AndQuery(
-            self.get_search_query(user, permission, class_id),
-            PhraseQuery('abspath', str(resource.abspath)))
-
-        # Search
-        results = get_context().search(query, user=user)
-        return len(results) > 0
+        # Special case: admins can do everything
+        user_groups, is_admin = self._get_user_groups(user)
+        if is_admin:
+            return True
+
+        # Cache (the CRON does not follow the access rules when searching)
+        context = get_context()
+        abspath = str(resource.abspath)
+        if context.is_cron:
+            key = None
+        else:
+            key = access_cache.get_key(user, user_groups, permission,
+                                       class_id)
+            value = access_cache.get(abspath, key)
+            if value is not None:
+                return value
+
+        # Evaluate the rules, the resource must be visible as well
+        rules = self.get_access_rules()
+        value = rules.has_permission(user, user_groups, permission, resource,
+                                     class_id)
+        if value and permission != 'view' and not context.is_cron:
+            value = rules.has_permission(user, user_groups, 'view', resource)
+
+        if key is not None:
+            access_cache.set(abspath, key, value)
+        return value
 
 
     def get_document_types(self):
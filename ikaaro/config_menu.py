@@ -19,6 +19,7 @@
 from copy import deepcopy
 
 # Import from itools
+from itools.core import LRUCache
 from itools.gettext import MSG
 from itools.handlers import checkid
 from itools.uri import Path
@@ -30,6 +31,7 @@ from autoform import PathSelectorWidget
 from config import Configuration
 from config_common import NewResource_Local
 from buttons import Remove_BrowseButton
+from database import register_commit_hook
 from fields import Select_Field, URI_Field
 from order import OrderedFolder, OrderedFolder_BrowseContent
 from utils import split_reference
@@ -132,41 +134,67 @@ class MenuItem(OrderedFolder):
         return len(resource_views) > 0
 
 
-    def get_menu_namespace_level(self, context, url, use_first_child=False):
+    def get_menu_entries(self, context, use_first_child=False):
+        """Returns the entries of the menu visible by the user of the given
+        context, without the flags that depend on the current page (see
+        'get_menu_items').  The entries are cached by user, group set and
+        language, the anonymous users share the same entries.
+        """
+        root = context.root
+        user = context.user
+        access = root.get_resource('config/access')
+        user_groups, is_admin = access._get_user_groups(user)
+        # The resources owned by or shared with a user are visible to that
+        # user only, so the groups are not enough
+        userid = user.name if user else None
+        languages = root.get_value('website_languages')
+        language = context.accept_language.select_language(languages)
+        key = (str(self.abspath), userid, frozenset(user_groups), language,
+               use_first_child)
+
+        entries = menu_cache.get(key)
+        if entries is None:
+            menus, paths = set(), set()
+            entries = self._get_menu_entries(context, use_first_child, menus,
+                                             paths)
+            menu_cache.set(key, entries, menus, paths)
+        return entries
+
+
+    def _get_menu_entries(self, context, use_first_child, menus, paths):
         menu_abspath = self.abspath
-        here = context.resource
-        here_abspath = here.abspath
-        here_view_name = url[-1]
-        here_abspath_and_view = '%s/%s' % (here_abspath, here_view_name)
-        items = []
+        menus.add(str(menu_abspath))
+        entries = []
 
         for resource in self.get_resources_in_order():
+            paths.add(str(resource.abspath))
             uri = resource.get_value('path')
+            ref, path, view = split_reference(uri)
+            if ref is not None and not ref.scheme and path:
+                paths.add(str(menu_abspath.resolve2(path)))
             if not self._is_allowed_to_access(context, uri):
                 continue
-            ref, path, view = split_reference(uri)
             title = resource.get_value('title')
             target = resource.get_value('target')
 
             # Case 1: External link
             if ref.scheme:
-                items.append({
+                entries.append({
                     'id': 'menu_%s' % resource.name,
                     'path': str(ref),
                     'real_path': None,
                     'title': title,
                     'description': None,
-                    'in_path': False,
-                    'active': False,
-                    'class': None,
                     'target': target,
-                    'items': []})
+                    'items': [],
+                    'abspath_and_view': None,
+                    'original_abspath': None})
                 continue
 
             # Case 2: Internal link
             # Sub level
-            subtabs = resource.get_menu_namespace_level(context, url,
-                                                        use_first_child)
+            subtabs = resource._get_menu_entries(context, use_first_child,
+                                                 menus, paths)
             resource = self.get_resource(path, soft=True)
             item_id = 'menu_%s' % resource.name
 
@@ -181,8 +209,6 @@ class MenuItem(OrderedFolder):
                 if sub_path is not None:
                     resource_path = sub_path
 
-            # Set active, in_path
-            active = in_path = False
             # add default view
             if view:
                 resource_method = view[2:]
@@ -191,17 +217,6 @@ class MenuItem(OrderedFolder):
                 resource_method = resource.get_default_view_name()
             resource_abspath_and_view = '%s/;%s' % (resource.abspath,
                                                     resource_method)
-            if here_abspath_and_view == resource_abspath_and_view:
-                active = True
-            else:
-                # Use the original path for the highlight
-                res_abspath = menu_abspath.resolve2(resource_original_path)
-                common_prefix = here_abspath.get_prefix(res_abspath)
-                # Avoid to always set the root entree 'in_path'
-                # If common prefix equals root abspath set in_path to False
-                # otherwise compare common_prefix and res_abspath
-                if common_prefix != Path('/'):
-                    in_path = (common_prefix == res_abspath)
 
             # Build the new reference with the right path
             ref2 = deepcopy(ref)
@@ -210,39 +225,134 @@ class MenuItem(OrderedFolder):
             if view:
                 ref2.path += view
 
-            items.append({
+            entries.append({
                 'id': item_id,
                 'path': str(ref2),
                 'real_path': resource.abspath,
                 'title': title,
                 'description': None, # FIXME
-                'in_path': active or in_path,
-                'active': active,
-                'class': None,
                 'target': target,
-                'items': subtabs})
+                'items': subtabs,
+                # Used to set the active and in_path flags
+                'abspath_and_view': resource_abspath_and_view,
+                'original_abspath': menu_abspath.resolve2(
+                    resource_original_path)})
+
+        return entries
+
+
+    def get_menu_namespace_level(self, context, url, use_first_child=False):
+        here_abspath = context.resource.abspath
+        here_view_name = url[-1]
+        here_abspath_and_view = '%s/%s' % (here_abspath, here_view_name)
+        entries = self.get_menu_entries(context, use_first_child)
+        return get_menu_items(entries, here_abspath, here_abspath_and_view)
+
+
+
+def get_menu_items(entries, here_abspath, here_abspath_and_view):
+    """Returns the namespace of the given menu entries for the page with
+    the given abspath and view: sets the active and in_path flags, and the
+    CSS classes.
+    """
+    items = []
+    for entry in entries:
+        item = dict(entry)
+        abspath_and_view = item.pop('abspath_and_view')
+        res_abspath = item.pop('original_abspath')
+
+        # Set active, in_path
+        active = in_path = False
+        if abspath_and_view is None:
+            # External link
+            pass
+        elif here_abspath_and_view == abspath_and_view:
+            active = True
+        else:
+            # Use the original path for the highlight
+            common_prefix = here_abspath.get_prefix(res_abspath)
+            # Avoid to always set the root entree 'in_path'
+            # If common prefix equals root abspath set in_path to False
+            # otherwise compare common_prefix and res_abspath
+            if common_prefix != Path('/'):
+                in_path = (common_prefix == res_abspath)
+
+        item['in_path'] = active or in_path
+        item['active'] = active
+        item['class'] = None
+        item['items'] = get_menu_items(item['items'], here_abspath,
+                                       here_abspath_and_view)
+        items.append(item)
+
+    # Set class
+    x = None
+    for i, item in enumerate(items):
+        if item['active']:
+            x = i
+            break
+        if item['in_path'] and x is None:
+            x = i
+            break
+    if x is not None:
+        items[x]['class'] = 'in-path'
+
+    if len(items) > 0:
+        # Add class "first" to the first item
+        css = items[0]['class'] or ''
+        items[0]['class'] = css + ' first'
+        # Add class "last" to the last item
+        css = items[-1]['class'] or ''
+        items[-1]['class'] = css + ' last'
+
+    return items
+
+
+
+###########################################################################
+# Cache
+###########################################################################
+class MenuCache(object):
+    """Cache of the menu entries by user, the anonymous users share the
+    same entries.  Everything is dropped when a menu, the access rules or
+    a resource linked by a menu change.
+    """
+
+    def __init__(self, size_min=200, size_max=250):
+        self.entries = LRUCache(size_min, size_max)
+        # The menus, their items and the resources they link to
+        self.menus = set()
+        self.paths = set()
+
+
+    def get(self, key):
+        return self.entries.get(key)
+
+
+    def set(self, key, entries, menus, paths):
+        self.entries[key] = entries
+        self.menus.update(menus)
+        self.paths.update(paths)
+
+
+    def clear(self):
+        self.entries.clear()
+        self.menus.clear()
+        self.paths.clear()
+
 
-        # Set class
-        x = None
-        for i, item in enumerate(items):
-            if item['active']:
-                x = i
-                break
-            if item['in_path'] and x is None:
-                x = i
-                break
-        if x is not None:
-            items[x]['class'] = 'in-path'
+    def on_commit(self, database, paths):
+        for path in paths:
+            parent = path.rsplit('/', 1)[0] or '/'
+            if (path in self.paths or path in self.menus
+                    or parent in self.menus
+                    or path == '/config/access'
+                    or path.startswith('/config/access/')):
+                self.clear()
+                return
 
-        if len(items) > 0:
-            # Add class "first" to the first item
-            css = items[0]['class'] or ''
-            items[0]['class'] = css + ' first'
-            # Add class "last" to the last item
-            css = items[-1]['class'] or ''
-            items[-1]['class'] = css + ' last'
 
-        return items
+menu_cache = MenuCache()
+register_commit_hook(menu_cache.on_commit)
 
 
 
@@ -259,14 +369,11 @@ class ConfigMenu(MenuItem):
     def init_resource(self, **kw):
         super(ConfigMenu, self).init_resource(**kw)
         # Menu
-        order = []
         menus = [('/', u'Home'), ('/;contact', u'Contact')]
         for path, title in menus:
             name = checkid(title)
-            order.append(name)
             self.make_resource(name, MenuItem, path=path,
                                title={'en': title})
-        self.set_property('order', order)
 
     # Configuration
     config_name = 'menu'
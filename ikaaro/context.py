@@ -76,20 +76,14 @@ class CMSContext(Context):
         local_path = local_root + web_path[len(web_root):]
 
         # 3. Get the handler
-        handler = ro_database.get_handler(local_path, soft=True)
-        if handler:
-            return handler
+        languages = template_languages.get(local_path)
+        if languages is None:
+            languages = get_template_languages(local_path)
+            template_languages[local_path] = languages
+        if languages is True:
+            return ro_database.get_handler(local_path)
 
         # 4. Not an exact match: trigger language negotiation
-        folder_path, name = local_path.rsplit('/', 1)
-        name = name + '.'
-        n = len(name)
-        languages = []
-        for x in lfs.get_names(folder_path):
-            if x[:n] == name:
-                language = x[n:]
-                if has_language(language):
-                    languages.append(language)
         if not languages:
             return None
 
@@ -141,6 +135,28 @@ def _fix_path(path):
     return path if path[-1] == '/' else path + '/'
 
 
+# The language variants of the templates {local_path: languages}, where
+# languages is True for an exact match
+template_languages = {}
+
+def get_template_languages(local_path):
+    if lfs.is_file(local_path):
+        return True
+
+    folder_path, name = local_path.rsplit('/', 1)
+    if not lfs.is_folder(folder_path):
+        return []
+    name = name + '.'
+    n = len(name)
+    languages = []
+    for x in lfs.get_names(folder_path):
+        if x[:n] == name:
+            language = x[n:]
+            if has_language(language):
+                languages.append(language)
+    return languages
+
+
 ui_registry = {}
 def register_ui(web_root, local_root):
     web_root = _fix_path(web_root)
@@ -148,3 +164,4 @@ def register_ui(web_root, local_root):
     if not isdir(local_root):
         raise ValueError, 'unexpected %s' % repr(local_root)
     ui_registry[web_root] = local_root
+    template_languages.clear()
@@ -16,26 +16,145 @@
 
 # Import from standard library
 from copy import deepcopy
+from fnmatch import fnmatch
+from os import makedirs, walk
+from os.path import dirname, exists, isdir, join
+from shutil import copy2, copytree
+from time import time
 
 # Import from itools
 from itools.database import RODatabase, RWDatabase, make_git_database
 from itools.database import OrQuery, PhraseQuery
+from itools.log import log_debug
 from itools.uri import Path
 from itools.web import get_context
 
 
+###########################################################################
+# Commit hooks
+###########################################################################
+commit_hooks = []
+def register_commit_hook(hook):
+    """Register a callable to be called after every commit, with the
+    database and the set of abspaths (as strings) that were changed, added,
+    moved or removed.  Used to invalidate the in-process caches.
+    """
+    commit_hooks.append(hook)
+
+
+
 class Database(RWDatabase):
     """Adds a Git archive to the itools database.
     """
 
+    changed_paths = None
+    commit_timings = None
+
+
+    def save_changes(self):
+        self.changed_paths = set()
+        try:
+            super(Database, self).save_changes()
+        finally:
+            paths, self.changed_paths = self.changed_paths, None
+            if paths:
+                for hook in commit_hooks:
+                    hook(self, paths)
+
+
+    def _abort_changes(self):
+        # The files copied by 'copy_files' have no handler in the cache, the
+        # checkout of Git removes them
+        cache = self.cache
+        for key in [ x for x in self.added if x not in cache ]:
+            self.added.discard(key)
+        super(Database, self)._abort_changes()
+
+
+    def has_changes(self, key):
+        """Returns whether the handler with the given key, or a handler
+        below it, has changes not yet saved to the filesystem.
+        """
+        key = self.normalize_key(key)
+        n = len(key)
+        for keys in self.added, self.changed, self.removed:
+            for f_key in keys:
+                if f_key[:n] == key and (len(f_key) == n or f_key[n] == '/'):
+                    return True
+        return False
+
+
+    def copy_files(self, source, target, exclude_patterns=None):
+        """Same as 'copy_handler', but the file or folder is copied with
+        one filesystem operation, without loading and cloning the handlers.
+        The source must not have changes not yet saved (see 'has_changes').
+        """
+        source = self.normalize_key(source)
+        target = self.normalize_key(target)
+
+        # The trivial case
+        if source == target:
+            return
+
+        # Ignore copy of some handlers
+        if exclude_patterns is None:
+            exclude_patterns = []
+        for exclude_pattern in exclude_patterns:
+            if fnmatch(source, exclude_pattern):
+                return
+
+        # Check the target is free
+        if self._get_handler(target, soft=True) is not None:
+            raise RuntimeError, 'The "%s" URI is busy.' % target
+
+        # Copy
+        source_path = join(self.path_data, source)
+        target_path = join(self.path_data, target)
+        if isdir(source_path):
+            n = len(source_path)
+            def ignore(folder, names):
+                key = source + folder[n:]
+                return [ x for x in names
+                         if [ y for y in exclude_patterns
+                              if fnmatch('%s/%s' % (key, x), y) ] ]
+            copytree(source_path, target_path, ignore=ignore)
+        else:
+            folder = dirname(target_path)
+            if not exists(folder):
+                makedirs(folder)
+            copy2(source_path, target_path)
+
+        # Added
+        n = len(self.path_data)
+        if isdir(target_path):
+            for folder, folders, files in walk(target_path):
+                for name in files:
+                    self.added.add(join(folder, name)[n:])
+        else:
+            self.added.add(target)
+
+        # Changed
+        self.removed.discard(target)
+        self.has_changed = True
+
+
+    def _log_phase(self, name, t0):
+        t1 = time()
+        self.commit_timings.append((name, t1 - t0))
+        return t1
+
+
     def _before_commit(self):
         context = get_context()
         root = context.root
+        self.commit_timings = []
+        t0 = time()
 
         # Update resources
         for path in deepcopy(self.resources_new2old):
             resource = root.get_resource(path)
             resource.update_resource(context)
+        t0 = self._log_phase('update', t0)
 
         # 1. Update links when resources moved
         # XXX With this code '_on_move_resource' is called for new resources,
@@ -47,44 +166,71 @@ class Database(RWDatabase):
             target = Path(target)
             resource = root.get_resource(target)
             resource._on_move_resource(source)
+        # Then update the resources that link to the moved ones, every
+        # referrer once, for all the moved resources it links to
+        links_map = dict([ (s, Path(t)) for s, t in old2new ])
+        referrers = {}
+        sources = links_map.keys()
+        for n in range(0, len(sources), 200):
+            chunk = sources[n:n+200]
+            query = [ PhraseQuery('links', x) for x in chunk ]
+            for brain in self.search(OrQuery(*query)).get_documents():
+                path = self.resources_old2new.get(brain.abspath, brain.abspath)
+                if path is None:
+                    continue
+                links = referrers.setdefault(path, {})
+                # Catalogs made by older versions do not store the links
+                for link in brain.links or chunk:
+                    if link in links_map:
+                        links[link] = links_map[link]
+        for path in sorted(referrers):
+            resource = root.get_resource(path)
+            resource.update_links_map(referrers[path])
+        t0 = self._log_phase('move', t0)
 
         # 2. Find out resources to re-index because they depend on another
-        # resource that changed
+        # resource that changed.  Every round only looks up the paths found
+        # by the previous one, until no new dependent is found.
         to_reindex = set()
-        aux = set()
-        aux2 = set(self.resources_old2new.keys())
-        while len(aux) != len(aux2):
-            aux = set(aux2)
+        seen = set(self.resources_old2new)
+        frontier = list(seen)
+        while frontier:
+            found = set()
             # XXX we regroup items by 200 because Xapian is slow
             # when there's too much items in OrQuery
-            l_aux = list(aux)
-            for sub_aux in [l_aux[n:n+200] for n in range(0, len(l_aux), 200)]:
-                query = [ PhraseQuery('onchange_reindex', x) for x in sub_aux ]
-                query = OrQuery(*query)
-                search = self.search(query)
+            for n in range(0, len(frontier), 200):
+                query = [ PhraseQuery('onchange_reindex', x)
+                          for x in frontier[n:n+200] ]
+                search = self.search(OrQuery(*query))
                 for brain in search.get_documents():
-                    path = brain.abspath
-                    aux2.add(path)
-                    to_reindex.add(path)
+                    found.add(brain.abspath)
+            to_reindex.update(found)
+            frontier = list(found - seen)
+            seen.update(found)
+        t0 = self._log_phase('dependents', t0)
 
         # 3. Documents to unindex (the update_links methods calls
         # 'change_resource' which may modify the resources_old2new dictionary)
         docs_to_unindex = self.resources_old2new.keys()
         docs_to_unindex = list(set(docs_to_unindex) | to_reindex)
         self.resources_old2new.clear()
+        if self.changed_paths is not None:
+            self.changed_paths.update(docs_to_unindex)
+            self.changed_paths.update(self.resources_new2old)
 
         # 4. Update mtime/last_author
         user = context.user
         userid = user.name if user else None
-        for path in self.resources_new2old:
-            if context.set_mtime:
+        if context.set_mtime:
+            for path in self.resources_new2old:
                 resource = root.get_resource(path)
                 resource.metadata.set_property('mtime', context.timestamp)
                 resource.metadata.set_property('last_author', userid)
+        t0 = self._log_phase('mtime', t0)
 
-        # 5. Index
-        docs_to_index = self.resources_new2old.keys()
-        docs_to_index = list(set(docs_to_index) | to_reindex)
+        # 5. Index (every resource once, even if it changed and depends on
+        # another resource that changed)
+        docs_to_index = set(self.resources_new2old) | to_reindex
         aux = []
         for path in docs_to_index:
             resource = root.get_resource(path, soft=True)
@@ -93,6 +239,10 @@ class Database(RWDatabase):
                 aux.append((resource, values))
         docs_to_index = aux
         self.resources_new2old.clear()
+        self._log_phase('index', t0)
+        log_debug('Commit timings: %s' % ', '.join(
+            [ '%s %.03fs' % x for x in self.commit_timings ]),
+            domain='ikaaro')
 
         # 6. Find out commit author & message
         if user:
@@ -29,7 +29,7 @@ from itools.gettext import MSG
 from itools.handlers import get_handler_class_by_mimetype
 from itools.html import XHTMLFile, xhtml_uri
 from itools.stl import rewrite_uris
-from itools.uri import Reference, get_reference
+from itools.uri import Path, Reference, get_reference
 from itools.web import get_context
 from itools.xml import START_ELEMENT
 
@@ -43,6 +43,7 @@ from datatypes import Boolean3, BirthDate, HexadecimalColor, HTMLBody
 from datatypes import Password_Datatype, ChoosePassword_Datatype
 from datatypes import DaysOfWeek
 from links import get_abspath_links, update_abspath_links
+from links import get_cached_references
 from utils import split_reference, get_secure_hash
 
 
@@ -128,6 +129,17 @@ class Field(BaseField):
         pass
 
 
+    def update_links_map(self, resource, field_name, links_map, languages,
+                         old_base, new_base):
+        """Same as 'update_links' for several resources moved at once:
+        'links_map' maps their old absolute paths (strings) to the new ones
+        ('Path' objects).  By default 'update_links' is called for each.
+        """
+        for source, target in links_map.iteritems():
+            self.update_links(resource, field_name, Path(source), target,
+                              languages, old_base, new_base)
+
+
     def update_incoming_links(self, resource, field_name, source, languages):
         pass
 
@@ -333,8 +345,15 @@ class SelectAbspath_Field(Select_Field):
 
     def update_links(self, resource, field_name, source, target, languages,
                      old_base, new_base):
-        update_abspath_links(self, resource, field_name, source, target,
-                         languages, old_base, new_base)
+        links_map = {str(source): target}
+        self.update_links_map(resource, field_name, links_map, languages,
+                              old_base, new_base)
+
+
+    def update_links_map(self, resource, field_name, links_map, languages,
+                         old_base, new_base):
+        update_abspath_links(self, resource, field_name, links_map,
+                             languages, old_base, new_base)
 
 
     def update_incoming_links(self, resource, field_name, source, languages):
@@ -413,6 +432,13 @@ class URI_Field(Metadata_Field):
 
     def update_links(self, resource, field_name, source, target, languages,
                      old_base, new_base):
+        links_map = {str(source): target}
+        self.update_links_map(resource, field_name, links_map, languages,
+                              old_base, new_base)
+
+
+    def update_links_map(self, resource, field_name, links_map, languages,
+                         old_base, new_base):
         if not self.multilingual:
             languages = [None]
 
@@ -432,7 +458,8 @@ class URI_Field(Metadata_Field):
                     if ref.scheme:
                         continue
                     path = old_base.resolve2(path)
-                    if path == source:
+                    target = links_map.get(str(path))
+                    if target is not None:
                         # Explicitly call str because URI.encode does
                         # nothing
                         new_value = str(new_base.get_pathto(target)) + view
@@ -450,7 +477,8 @@ class URI_Field(Metadata_Field):
                 if ref.scheme:
                     continue
                 path = old_base.resolve2(path)
-                if path == source:
+                target = links_map.get(str(path))
+                if target is not None:
                     # Hit the old name
                     # Build the new reference with the right path
                     # Explicitly call str because URI.encode does nothing
@@ -520,10 +548,10 @@ class Abspath_Field(URI_Field):
         return get_abspath_links(self, links, resource, field_name, languages)
 
 
-    def update_links(self, resource, field_name, source, target, languages,
-                     old_base, new_base):
-        update_abspath_links(self, resource, field_name, source, target,
-                         languages, old_base, new_base)
+    def update_links_map(self, resource, field_name, links_map, languages,
+                         old_base, new_base):
+        update_abspath_links(self, resource, field_name, links_map,
+                             languages, old_base, new_base)
 
 
     def update_incoming_links(self, resource, field_name, source, languages):
@@ -641,6 +669,48 @@ map = {'a': 'href', 'img': 'src', 'iframe': 'src',
        'param': 'src'}
 
 
+def get_html_references(handler):
+    """Returns the paths referenced by the given XHTML handler, relative to
+    the resource, but external links and links to '/ui/'.
+    """
+    references = []
+    for event, value, line in handler.events:
+        if event != START_ELEMENT:
+            continue
+        tag_uri, tag_name, attributes = value
+        if tag_uri != xhtml_uri:
+            continue
+
+        # Get the attribute name and value
+        attr_name = map.get(tag_name)
+        if attr_name is None:
+            continue
+
+        attr_name = (None, attr_name)
+        value = attributes.get(attr_name)
+        if value is None:
+            continue
+
+        reference = get_reference(value)
+
+        # Skip empty links, external links and links to '/ui/'
+        if reference.scheme or reference.authority:
+            continue
+        path = reference.path
+        if not path or path.is_absolute() and path[0] == 'ui':
+            continue
+
+        # Strip the view
+        name = path.get_name()
+        if name and name[0] == ';':
+            path = path[:-1]
+
+        references.append(path)
+
+    return references
+
+
+
 class HTMLFile_Field(File_Field):
 
     rest_type = 'file-html'
@@ -665,37 +735,7 @@ class HTMLFile_Field(File_Field):
             handler = self.get_value(resource, field_name, language)
             if not handler:
                 continue
-            for event, value, line in handler.events:
-                if event != START_ELEMENT:
-                    continue
-                tag_uri, tag_name, attributes = value
-                if tag_uri != xhtml_uri:
-                    continue
-
-                # Get the attribute name and value
-                attr_name = map.get(tag_name)
-                if attr_name is None:
-                    continue
-
-                attr_name = (None, attr_name)
-                value = attributes.get(attr_name)
-                if value is None:
-                    continue
-
-                reference = get_reference(value)
-
-                # Skip empty links, external links and links to '/ui/'
-                if reference.scheme or reference.authority:
-                    continue
-                path = reference.path
-                if not path or path.is_absolute() and path[0] == 'ui':
-                    continue
-
-                # Strip the view
-                name = path.get_name()
-                if name and name[0] == ';':
-                    path = path[:-1]
-
+            for path in get_cached_references(handler, get_html_references):
                 uri = base.resolve2(path)
                 uri = str(uri)
                 links.add(uri)
@@ -703,6 +743,13 @@ class HTMLFile_Field(File_Field):
 
     def update_links(self, resource, field_name, source, target, languages,
                      old_base, new_base):
+        links_map = {str(source): target}
+        self.update_links_map(resource, field_name, links_map, languages,
+                              old_base, new_base)
+
+
+    def update_links_map(self, resource, field_name, links_map, languages,
+                         old_base, new_base):
         for language in languages:
             handler = self.get_value(resource, field_name, language)
             if not handler:
@@ -750,9 +797,10 @@ class HTMLFile_Field(File_Field):
                 else:
                     view = ''
 
-                # Check the link points to the resource that is moving
+                # Check the link points to a resource that is moving
                 path = old_base.resolve2(path)
-                if path != source:
+                target = links_map.get(str(path))
+                if target is None:
                     events.append(event)
                     continue
 
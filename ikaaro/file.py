@@ -18,12 +18,16 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+# Import from the Standard Library
+from traceback import format_exc
+
 # Import from itools
 from itools.core import guess_all_extensions
 from itools.gettext import MSG
 from itools.handlers import File as FileHandler
 from itools.handlers import Image as ImageHandler, SVGFile
 from itools.handlers import TARFile, ZIPFile, GzipFile, Bzip2File
+from itools.log import log_error
 from itools.odf import SXWFile, SXCFile, SXIFile, ODTFile, ODSFile, ODPFile
 from itools.pdf import PDFFile
 from itools.office import RTF as RTFFile
@@ -43,6 +47,7 @@ from file_views import File_Download
 from file_views import Image_View, Video_View, Archive_View
 from file_views import Flash_View
 from resource_views import DBResource_GetImage
+from thumbnails import get_thumbnail
 
 
 
@@ -131,6 +136,10 @@ class Image(File):
     # Fields
     data = File.data(class_handler=ImageHandler)
 
+    # Thumbnails made at upload time (width, height), the most common sizes
+    # in galleries, folder listings and the image view
+    thumbnail_sizes = [(48, 48), (128, 128), (800, 600)]
+
     def get_max_width(self):
         # Auto-reduce width on init
         server = get_context().server
@@ -147,8 +156,15 @@ class Image(File):
         return None
 
 
+    # The thumbnails are made by 'init_resource', once the image is resized
+    initializing = False
+
     def init_resource(self, **kw):
-        super(Image, self).init_resource(**kw)
+        self.initializing = True
+        try:
+            super(Image, self).init_resource(**kw)
+        finally:
+            del self.initializing
         # Resize image at max size
         max_width = self.get_max_width()
         max_height = self.get_max_height()
@@ -159,6 +175,37 @@ class Image(File):
                 min(xsize, max_width or xsize),
                 min(ysize, max_height or ysize))
             handler.load_state_from_string(thumb)
+        self.make_thumbnails()
+
+
+    def set_value(self, name, value, language=None, **kw):
+        proxy = super(Image, self)
+        result = proxy.set_value(name, value, language, **kw)
+        if name == 'data' and not self.initializing:
+            self.make_thumbnails()
+        return result
+
+
+    def make_thumbnails(self):
+        """Fills the thumbnails store with the thumbnails of the common
+        sizes, so galleries do not have to make them on the first view.
+        """
+        server = get_context().server
+        if server is None or server.thumbnails is None:
+            return
+
+        handler = self.get_value('data')
+        if handler is None:
+            return
+        format = handler.get_mimetype().split('/')[1]
+        try:
+            for width, height in self.thumbnail_sizes:
+                get_thumbnail(handler, width, height, format)
+        except Exception:
+            # The thumbnails will be made when asked for (or fail then)
+            log_error('Thumbnail error: %s\n%s' % (self.abspath,
+                                                     format_exc()),
+                      domain='ikaaro')
 
     # Views
     thumb = DBResource_GetImage(field_name='data')
@@ -171,6 +218,7 @@ class SVG(Image):
     class_title = MSG(u'Image SVG')
     # Fields
     data = Image.data(class_handler=SVGFile)
+    thumbnail_sizes = []
 
 
 
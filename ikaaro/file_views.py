@@ -298,10 +298,16 @@ class Archive_View(STLView):
 
         # Make the resources
         language = resource.get_edit_languages(context)[0]
-        target.extract_archive(handler, language, update=form['update'])
+        errors = target.extract_archive(handler, language,
+                                        update=form['update'])
 
         # Ok
-        message = MSG(u'Files extracted')
+        if errors:
+            paths = ', '.join([ x for x, error in errors ])
+            message = ERROR(u'Some files could not be extracted: {paths}')
+            message = message(paths=paths)
+        else:
+            message = MSG(u'Files extracted')
         goto = context.get_link(target)
         return context.come_back(message, goto=goto)
 
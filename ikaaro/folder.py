@@ -19,20 +19,24 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # Import from the Standard Library
-from cStringIO import StringIO
+from os.path import isfile, join
+from tempfile import TemporaryFile
 from zipfile import ZipFile
 
 # Import from itools
 from itools.core import is_prototype
+from itools.database import register_field
+from itools.datatypes import String
 from itools.fs import FileName
 from itools.gettext import MSG
 from itools.handlers import checkid
-from itools.html import XHTMLFile
 from itools.i18n import guess_language
+from itools.log import log_info, log_warning
 from itools.uri import Path
 from itools.web import BaseView, get_context
 
 # Import from ikaaro
+from autoadd import Location_Search
 from autoedit import AutoEdit
 from database import Database
 from datatypes import guess_mimetype
@@ -43,7 +47,8 @@ from folder_views import Folder_Rename, Folder_NewResource, Folder_Thumbnail
 from folder_views import Folder_View
 from messages import MSG_NAME_CLASH
 from resource_ import DBResource
-from utils import process_name, tidy_html
+from utils import get_git_blob_id, get_handler_blob_id, process_name
+from utils import tidy_html
 
 
 
@@ -80,6 +85,14 @@ class Folder(DBResource):
                  for class_id in document_types ]
 
 
+    def get_catalog_values(self):
+        values = super(Folder, self).get_catalog_values()
+        # The classes of the resources that can be added to this folder
+        values['document_types'] = [
+            cls.class_id for cls in self.get_document_types() ]
+        return values
+
+
     #######################################################################
     # API
     #######################################################################
@@ -99,28 +112,32 @@ class Folder(DBResource):
             class_id = mimetype
         cls = self.database.get_resource_class(class_id)
 
-        # Special case: web pages
+        # Special case: web pages, parse the body once with the handler
+        # class of the field
         kw = {'filename': filename, 'data': body}
         if issubclass(cls, WebPage):
+            handler = cls.get_field('data').class_handler(string=body)
             kk, kk, language = FileName.decode(filename)
             if language is None:
-                text = XHTMLFile(string=body).to_text()
+                text = handler.to_text()
                 language = guess_language(text) or default_language
-            kw['data'] = {language: body}
+            kw['data'] = {language: handler}
 
         return self.make_resource(name, cls, **kw)
 
 
-    def export_zip(self, paths):
-        stringio = StringIO()
-        archive = ZipFile(stringio, mode='w')
+    def get_files_to_export(self, paths):
+        """Yields the tuple (name, key) of every file of the given resources
+        (and of the resources within the folders), where name is the path
+        of the file in the archive and key is the key of its handler.
+        """
+        base = Path(self.handler.key)
 
-        def _add_resource(resource):
-            for filename in resource.get_files_to_archive(True):
-                if filename.endswith('.metadata'):
+        def _get_files(resource):
+            for key in resource.get_files_to_archive(True):
+                if key.endswith('.metadata'):
                     continue
-                path = Path(self.handler.key).get_pathto(filename)
-                archive.writestr(str(path), resource.handler.to_str())
+                yield str(base.get_pathto(key)), key
 
         for path in paths:
             child = self.get_resource(path, soft=True)
@@ -131,17 +148,59 @@ class Folder(DBResource):
                 for subchild in child.traverse_resources():
                     if subchild is None or isinstance(subchild, Folder):
                         continue
-                    _add_resource(subchild)
+                    for x in _get_files(subchild):
+                        yield x
+            else:
+                for x in _get_files(child):
+                    yield x
+
+
+    def export_zip(self, paths, file=None):
+        """Writes to the given file a ZIP archive with the files of the given
+        resources.  The files are read from the worktree one by one, so the
+        archive is never held in memory.  Without a file the archive is
+        built in a temporary file, and its data is returned.
+        """
+        if file is None:
+            with TemporaryFile() as file:
+                self.export_zip(paths, file)
+                file.seek(0)
+                return file.read()
+
+        database = self.database
+        archive = ZipFile(file, mode='w', allowZip64=True)
+        n = 0
+        for name, key in self.get_files_to_export(paths):
+            if database.has_changes(key):
+                # Not yet saved to the filesystem
+                data = database.get_handler(key).to_str()
+                archive.writestr(name, data)
             else:
-                _add_resource(child)
+                path = join(database.path_data, key)
+                if not isfile(path):
+                    continue
+                archive.write(path, name)
+            # Progress
+            n += 1
+            if n % 1000 == 0:
+                log_info('ZIP export of %s: %d files' % (self.abspath, n),
+                         domain='ikaaro')
 
         archive.close()
-        return stringio.getvalue()
 
 
     def extract_archive(self, handler, default_language, filter=None,
                         postproc=None, update=False):
+        """Makes a resource for every file of the given archive handler, or
+        updates it if it exists and 'update' is true.  The files whose
+        content did not change are skipped, so an interrupted import can be
+        resumed by importing the same archive again with 'update'.
+
+        Returns the list of tuples (path, message) of the files that could
+        not be imported, the other files are imported anyway.
+        """
         change_resource = self.database.change_resource
+        errors = []
         for path_str in handler.get_contents():
             # 1. Skip folders
             clean_path = "/".join([
@@ -165,9 +224,13 @@ class Folder(DBResource):
                     folder = folder.make_resource(name, Folder)
                     folder.set_value('title', title, default_language)
                 elif not isinstance(subfolder, Folder):
-                    raise RuntimeError, MSG_NAME_CLASH
+                    folder = None
+                    break
                 else:
                     folder = subfolder
+            if folder is None:
+                errors.append((path_str, MSG_NAME_CLASH.gettext()))
+                continue
 
             # 3. Find out the resource name and title, the file mimetype and
             # language
@@ -180,30 +243,42 @@ class Folder(DBResource):
                 name = FileName.encode((name, extension, None))
 
             # 4. The body
-            body = handler.get_file(path_str)
-            if filter:
-                body = filter(path_str, mimetype, body)
-                if body is None:
-                    continue
+            try:
+                body = handler.get_file(path_str)
+                if filter:
+                    body = filter(path_str, mimetype, body)
+                    if body is None:
+                        continue
+                if mimetype == 'text/html':
+                    body = tidy_html(body)
+                    mimetype = 'application/xhtml+xml'
+            except Exception, e:
+                log_warning('Import failed: %s' % path_str, domain='ikaaro')
+                errors.append((path_str, unicode(str(e), 'utf-8', 'replace')))
+                continue
 
             # 5. Update or make file
             file = folder.get_resource(name, soft=True)
             if file:
                 if update is False:
-                    msg = 'unexpected resource at {path}'
-                    raise RuntimeError, msg.format(path=path_str)
-                if mimetype == 'text/html':
-                    body = tidy_html(body)
-                    file_handler = file.get_handler(language)
+                    errors.append((path_str, u'unexpected resource'))
+                    continue
+                if mimetype == 'application/xhtml+xml':
+                    file_handler = file.get_value('data', language)
                 else:
-                    file_handler = file.get_handler()
-                old_body = file.handler.to_str()
+                    file_handler = file.get_value('data')
+                if file_handler is None:
+                    errors.append((path_str, u'unexpected resource'))
+                    continue
+                # Compare the contents by their hash, the serialization of
+                # the new body may differ from the body (e.g. XML)
+                blob_id = get_handler_blob_id(file_handler)
+                if get_git_blob_id(body) == blob_id:
+                    continue
                 file_handler.load_state_from_string(body)
                 if postproc:
                     postproc(file)
-                # FIXME Comparing the bytes does not work for XML, so we use
-                # this weak heuristic
-                if len(old_body) != len(file.handler.to_str()):
+                if get_git_blob_id(file_handler.to_str()) != blob_id:
                     change_resource(file)
             else:
                 # Case 1: the resource does not exist
@@ -213,6 +288,8 @@ class Folder(DBResource):
                 if postproc:
                     postproc(file)
 
+        return errors
+
 
     def can_paste(self, source):
         """Is the source resource can be pasted into myself.
@@ -227,17 +304,18 @@ class Folder(DBResource):
         if type(target_path) is not Path:
             target_path = Path(target_path)
 
+        return source_path, target_path
+
+
+    def _load_handlers(self, source):
         # Load the handlers so they are of the right class, for resources
         # like that define explicitly the handler class.  This fixes for
         # instance copy&cut&paste of a tracker in a just started server.
         # TODO this is a work-around, there should be another way to define
         # explicitly the handler class.
-        source = self.get_resource(source_path)
         for resource in source.traverse_resources():
             resource.load_handlers()
 
-        return source_path, target_path
-
 
     def copy_resource(self, source_path, target_path, exclude_patterns=None):
         # Find out the source and target absolute URIs
@@ -257,14 +335,13 @@ class Folder(DBResource):
                                      target_parent.class_title.gettext())
             raise ConsistencyError(message)
 
-        # Copy the metadata
+        # The metadata and the content
         folder = self.handler
-        folder.copy_handler('%s.metadata' % source_path,
-                            '%s.metadata' % target_path)
-
-        # Copy the content
         database = self.database
         fs = database.fs
+        resolve = fs.resolve2
+        keys = [(resolve(folder.key, '%s.metadata' % source_path),
+                 resolve(folder.key, '%s.metadata' % target_path), None)]
         new_name = target_path.get_name()
         for old_name, new_name in source.rename_handlers(new_name):
             if old_name is None:
@@ -272,7 +349,19 @@ class Folder(DBResource):
             src_key = fs.resolve(source_path, old_name)
             dst_key = fs.resolve(target_path, new_name)
             if folder.has_handler(src_key):
-                folder.copy_handler(src_key, dst_key, exclude_patterns)
+                keys.append((resolve(folder.key, src_key),
+                             resolve(folder.key, dst_key), exclude_patterns))
+
+        # Copy every file or folder with one filesystem operation, unless
+        # the source has changes not yet saved: then copy the handlers
+        copy = database.copy_files
+        for src_key, dst_key, patterns in keys:
+            if database.has_changes(src_key):
+                self._load_handlers(source)
+                copy = database.copy_handler
+                break
+        for src_key, dst_key, patterns in keys:
+            copy(src_key, dst_key, patterns)
 
         # Events, add
         resource = self.get_resource(target_path)
@@ -287,6 +376,7 @@ class Folder(DBResource):
 
         # Get the source and target resources
         source = self.get_resource(source_path)
+        self._load_handlers(source)
         parent_path = target_path.resolve2('..')
         target_parent = self.get_resource(parent_path)
 
@@ -375,9 +465,11 @@ class Folder(DBResource):
     rename = Folder_Rename
     preview_content = Folder_PreviewContent
     thumb = Folder_Thumbnail
+    location_search = Location_Search
 
 
 ###########################################################################
 # Register
 ###########################################################################
 Database.register_resource_class(Folder, 'application/x-not-regular-file')
+register_field('document_types', String(multiple=True, indexed=True))
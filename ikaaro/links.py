@@ -14,12 +14,17 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+# Import from itools
+from itools.core import LRUCache
+from itools.database import AllQuery
+
 # Import from ikaaro
-from utils import split_reference
+from database import register_commit_hook
+from utils import get_handler_blob_id, split_reference
 
 
-def update_abspath_links(self, resource, field_name, source, target, languages,
-                 old_base, new_base):
+def update_abspath_links(self, resource, field_name, links_map, languages,
+                         old_base, new_base):
     if not self.multilingual:
         languages = [None]
 
@@ -43,7 +48,8 @@ def update_abspath_links(self, resource, field_name, source, target, languages,
                     if ref.scheme:
                         continue
                     path = old_base.resolve2(path)
-                    if path == source:
+                    target = links_map.get(str(path))
+                    if target is not None:
                         # Explicitly call str because URI.encode does
                         # nothing
                         new_value = str(target) + view
@@ -64,7 +70,8 @@ def update_abspath_links(self, resource, field_name, source, target, languages,
             if ref.scheme:
                 continue
             path = old_base.resolve2(path)
-            if path == source:
+            target = links_map.get(str(path))
+            if target is not None:
                 # Hit the old name
                 # Build the new reference with the right path
                 # Explicitly call str because URI.encode does nothing
@@ -104,3 +111,85 @@ def get_abspath_links(self, links, resource, field_name, languages):
                 # Singleton
                 links.add(str(path))
     return links
+
+
+
+###########################################################################
+# Link extraction
+###########################################################################
+# The references found in the files, by (function, blob id)
+references_cache = LRUCache(2000, 2500)
+
+def get_cached_references(handler, get_references):
+    """Returns the references found in the given file handler by the
+    'get_references' function.  They are memoized by the blob id of the
+    file, so the file is not parsed again while it does not change.
+    """
+    if handler.dirty:
+        return get_references(handler)
+
+    key = (get_references, get_handler_blob_id(handler))
+    references = references_cache.get(key)
+    if references is None:
+        references = references_cache[key] = get_references(handler)
+    return references
+
+
+
+###########################################################################
+# Link graph
+###########################################################################
+class LinkGraph(object):
+    """The links between the resources, as found in the catalog: the set of
+    all the abspaths, and the links of every resource.  It is built in one
+    pass over the stored values of the catalog, then the orphans and the
+    broken links are set differences.
+    """
+
+    def __init__(self, database):
+        abspaths = set()
+        # {source: [target, ...]}
+        links = {}
+        # All the targets
+        linked = set()
+        for brain in database.search(AllQuery()).get_documents():
+            abspath = brain.abspath
+            abspaths.add(abspath)
+            targets = brain.links
+            if targets:
+                links[abspath] = targets
+                linked.update(targets)
+
+        # The abspaths not linked from anywhere
+        self.orphans = frozenset(abspaths - linked)
+
+        # {source: [broken link, ...]}
+        self.broken_links = {}
+        missing = linked - abspaths
+        if missing:
+            for source, targets in links.iteritems():
+                targets = [ x for x in targets if x in missing ]
+                if targets:
+                    self.broken_links[source] = sorted(targets)
+
+
+
+class LinkGraphCache(object):
+    """Keeps the link graph until the next commit.
+    """
+
+    graph = None
+
+    def get_graph(self, database):
+        graph = self.graph
+        if graph is None:
+            graph = self.graph = LinkGraph(database)
+        return graph
+
+
+    def on_commit(self, database, paths):
+        self.graph = None
+
+
+link_graph_cache = LinkGraphCache()
+register_commit_hook(link_graph_cache.on_commit)
@@ -15,15 +15,17 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # Import from itools
+from itools.core import LRUCache, proto_lazy_property
 from itools.database import PhraseQuery
 from itools.gettext import MSG
-from itools.web import INFO, get_context
+from itools.web import INFO
 
 # Import from ikaaro
 from buttons import BrowseButton
 from fields import URI_Field
 from folder import Folder
 from folder_views import Folder_BrowseContent
+from utils import get_base_path_query, get_rank_between, get_ranks
 
 
 
@@ -104,24 +106,26 @@ class OrderedFolder_BrowseContent(Folder_BrowseContent):
         return query
 
 
+    @proto_lazy_property
+    def ordered_positions(self):
+        ordered_names = self.context.resource.get_ordered_values()
+        return dict([ (x, i) for i, x in enumerate(ordered_names) ])
+
+
     def get_key_sorted_by_order(self):
-        context = get_context()
-        ordered_names = list(context.resource.get_ordered_values())
-        nb_ordered_names = len(ordered_names)
+        positions = self.ordered_positions
+        nb_ordered_names = len(positions)
         def key(item):
-            try:
-                return ordered_names.index(item.name)
-            except ValueError:
-                return nb_ordered_names
+            return positions.get(item.name, nb_ordered_names)
 
         return key
 
 
     def get_item_value(self, resource, context, item, column):
         if column == 'order':
-            ordered_ids = list(resource.get_ordered_values())
-            if item.name in ordered_ids:
-                return ordered_ids.index(item.name) + 1
+            position = self.ordered_positions.get(item.name)
+            if position is not None:
+                return position + 1
             return MSG(u'Not ordered')
 
         proxy = super(OrderedFolder_BrowseContent, self)
@@ -131,14 +135,6 @@ class OrderedFolder_BrowseContent(Folder_BrowseContent):
     ######################################################################
     # Actions
     ######################################################################
-    def action_remove(self, resource, context, form):
-        # Remove from ordered list
-        resource.order_remove(form['ids'])
-        # Super
-        proxy = super(OrderedFolder_BrowseContent, self)
-        return proxy.action_remove(resource, context, form)
-
-
     def action_order_up(self, resource, context, form):
         ids = form['ids']
         resource.order_up(ids)
@@ -180,26 +176,55 @@ class OrderedFolder_BrowseContent(Folder_BrowseContent):
 # OrderAware
 ###############################################
 
+# The rank given by the last append to every folder {abspath: (name, rank)}
+last_ranks = LRUCache(500, 1000)
+
+
 class OrderedFolder(Folder):
+    """The resources of an ordered folder are sorted by their rank, a string
+    stored in their metadata and indexed.  To move a resource only its own
+    rank changes, see 'get_rank_between'.
+    """
 
+    class_version = '20170301'
     class_title = MSG(u'Ordered Folder')
     class_views = ['browse_content']
 
     # Fields
+    # Obsolete, replaced by the rank of the resources (see update_20170301)
     order = URI_Field(title=MSG(u'Order'), multiple=True)
 
     allow_to_unorder_items = False
 
+    # The ranks longer than this are spread again
+    rank_max_length = 32
+
 
     def make_resource(self, name, cls, **kw):
         resource = super(OrderedFolder, self).make_resource(name, cls, **kw)
         if self.can_be_ordered(cls):
-            order = self.get_value('order')
-            order = order + [resource.name]
-            self.set_value('order', order)
+            self._append(resource)
+        return resource
+
+
+    def copy_resource(self, source_path, target_path, exclude_patterns=None):
+        proxy = super(OrderedFolder, self)
+        resource = proxy.copy_resource(source_path, target_path,
+                                       exclude_patterns)
+        self._on_paste(resource)
         return resource
 
 
+    def move_resource(self, source_path, target_path):
+        parent_path = self.get_resource(source_path).parent.abspath
+        proxy = super(OrderedFolder, self)
+        proxy.move_resource(source_path, target_path)
+        # A renamed resource keeps its rank
+        resource = self.get_resource(target_path)
+        if resource.parent.abspath != parent_path:
+            self._on_paste(resource)
+
+
     base_classes = None
     def can_be_ordered(self, cls):
         if not self.base_classes:
@@ -210,75 +235,223 @@ class OrderedFolder(Folder):
         return False
 
 
-
+    #######################################################################
+    # Ranks
+    #######################################################################
+    def get_ranks(self):
+        """Returns a dict {name: rank} for the resources in this folder, the
+        rank is None for the resources not ordered.  The ranks are read
+        from the catalog, but for the resources changed in the current
+        transaction.
+        """
+        database = self.database
+        ranks = {}
+        query = get_base_path_query(self.abspath, 1, 1)
+        for brain in database.search(query).get_documents():
+            ranks[brain.name] = getattr(brain, 'rank', None) or None
+
+        # Not yet indexed
+        prefix = str(self.abspath).rstrip('/') + '/'
+        n = len(prefix)
+        for source, target in database.resources_old2new.items():
+            if source != target and source[:n] == prefix:
+                ranks.pop(source[n:], None)
+        for path in database.resources_new2old:
+            if path[:n] == prefix and '/' not in path[n:]:
+                resource = database.get_resource(path, soft=True)
+                if resource is not None:
+                    ranks[path[n:]] = resource.get_value('rank') or None
+        return ranks
+
+
+    def _get_last_rank(self, name):
+        """Returns the greatest rank in this folder, but for the resource
+        with the given name.  The rank given by the last '_append' of the
+        current transaction is used if it is still valid, so adding many
+        resources does not read all the ranks every time.
+        """
+        database = self.database
+        last = last_ranks.get(str(self.abspath))
+        if last is not None and last[0] != name:
+            last_name, last_rank = last
+            path = '%s/%s' % (str(self.abspath).rstrip('/'), last_name)
+            if path in database.resources_new2old:
+                last = database.get_resource(path, soft=True)
+                if last is not None and last.get_value('rank') == last_rank:
+                    return last_rank
+
+        ranks = self.get_ranks()
+        ranks.pop(name, None)
+        ranks = [ x for x in ranks.itervalues() if x ]
+        return max(ranks) if ranks else None
+
+
+    def _append(self, resource):
+        name = resource.name
+        rank = get_rank_between(self._get_last_rank(name))
+        if len(rank) > self.rank_max_length:
+            # Spread the ranks again, the resource last
+            ranks = self.get_ranks()
+            names = [ x for x in self.get_ordered_values()
+                      if ranks.get(x) and x != name ]
+            names.append(name)
+            self._set_ranks(names)
+            rank = resource.get_value('rank')
+        else:
+            resource.set_value('rank', rank)
+        last_ranks[str(self.abspath)] = (name, rank)
+
+
+    def _on_paste(self, resource):
+        # A resource copied or moved here keeps the rank it had in its
+        # folder, put it last instead
+        if resource.parent.abspath != self.abspath:
+            return
+        if self.can_be_ordered(type(resource)):
+            self._append(resource)
+        else:
+            resource.set_value('rank', None)
+
+
+    def _set_ranks(self, names):
+        """Sets the ranks of the resources with the given names, so they
+        are sorted as given.
+        """
+        last_ranks.pop(str(self.abspath), None)
+        for name, rank in zip(names, get_ranks(len(names))):
+            self.get_resource(name).set_value('rank', rank)
+
+
+    def _reorder(self, order, moved):
+        """Gives a new rank to the resources with the given names (moved), so
+        the resources are sorted as in the given list of names (order).
+        The not ordered resources before a moved one are ordered too, the
+        others keep their rank.
+        """
+        ranks = self.get_ranks()
+        moved = set(moved)
+        last = -1
+        for i, name in enumerate(order):
+            if name in moved:
+                last = i
+        for name in order[:last]:
+            if not ranks.get(name):
+                moved.add(name)
+
+        # The rank of the next resource not moved, for every position
+        after = []
+        rank = None
+        for name in reversed(order):
+            after.append(rank)
+            if name not in moved and ranks.get(name):
+                rank = ranks[name]
+        after.reverse()
+
+        # Compute the new ranks
+        new_ranks = {}
+        rank = None
+        for i, name in enumerate(order):
+            if name in moved:
+                try:
+                    rank = get_rank_between(rank, after[i])
+                except ValueError:
+                    # Two resources with the same rank
+                    rank = None
+                if rank is None or len(rank) > self.rank_max_length:
+                    return self._set_ranks(order)
+                new_ranks[name] = rank
+            else:
+                rank = ranks.get(name)
+
+        last_ranks.pop(str(self.abspath), None)
+        for name, rank in new_ranks.iteritems():
+            self.get_resource(name).set_value('rank', rank)
+
+
+    #######################################################################
+    # API
+    #######################################################################
     def get_ordered_values(self):
-        ordered_names = list(self.get_value('order'))
+        ranks = self.get_ranks()
+        ordered = [ (rank, name) for name, rank in ranks.iteritems() if rank ]
+        ordered_names = [ name for rank, name in sorted(ordered) ]
         # Unordered names
         if self.allow_to_unorder_items is False:
-            for name in self.get_names():
-                if name not in ordered_names:
-                    ordered_names.append(name)
+            unordered = [ x for x, rank in ranks.iteritems() if not rank ]
+            ordered_names.extend(sorted(unordered))
         return ordered_names
 
 
-    def get_resources_in_order(self):
-        for name in self.get_ordered_values():
+    def get_resources_in_order(self, start=0, size=None):
+        names = self.get_ordered_values()
+        if size is None:
+            names = names[start:]
+        else:
+            names = names[start:start+size]
+        for name in names:
             yield self.get_resource(name)
 
 
     def order_up(self, ids):
         order = self.get_ordered_values()
-        order = list(order)
+        positions = dict([ (x, i) for i, x in enumerate(order) ])
         for id in ids:
-            index = order.index(id)
+            index = positions[id]
             if index > 0:
-                order.remove(id)
-                order.insert(index - 1, id)
+                other = order[index - 1]
+                order[index - 1], order[index] = id, other
+                positions[id], positions[other] = index - 1, index
         # Update the order
-        self.set_value('order', order)
+        self._reorder(order, ids)
 
 
     def order_down(self, ids):
         order = self.get_ordered_values()
-        order = list(order)
+        positions = dict([ (x, i) for i, x in enumerate(order) ])
         for id in ids:
-            index = order.index(id)
-            order.remove(id)
-            order.insert(index + 1, id)
+            index = positions[id]
+            if index < len(order) - 1:
+                other = order[index + 1]
+                order[index + 1], order[index] = id, other
+                positions[id], positions[other] = index + 1, index
         # Update the order
-        self.set_value('order', order)
+        self._reorder(order, ids)
 
 
     def order_top(self, ids):
         order = self.get_ordered_values()
-        order = list(order)
         order = ids + [ id for id in order if id not in ids ]
         # Update the order
-        self.set_value('order', order)
+        self._reorder(order, ids)
 
 
     def order_bottom(self, ids):
         order = self.get_ordered_values()
-        order = list(order)
         order = [ id for id in order if id not in ids ] + ids
         # Update the order
-        self.set_value('order', order)
+        self._reorder(order, ids)
 
 
     def order_add(self, ids):
-        order = self.get_ordered_values()
-        order = list(order)
-        order = [ id for id in order if id not in ids ] + ids
-        # Update the order
-        self.set_value('order', order)
+        self.order_bottom(ids)
 
 
     def order_remove(self, ids):
-        order = self.get_ordered_values()
-        order = list(order)
-        order = [ id for id in order if id not in ids ]
-        # Update the order
-        self.set_value('order', order)
+        for id in ids:
+            resource = self.get_resource(id, soft=True)
+            if resource is not None:
+                resource.set_value('rank', None)
+
+
+    #######################################################################
+    # Upgrade
+    #######################################################################
+    update_20170301_title = MSG(u'Order the resources by rank')
+    def update_20170301(self):
+        names = [ x for x in self.get_value('order')
+                  if self.get_resource(x, soft=True) is not None ]
+        self._set_ranks(names)
+        self.del_property('order')
 
 
     # Views
@@ -0,0 +1,215 @@
+# -*- coding: UTF-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from collections import OrderedDict
+from hashlib import sha1
+from os import makedirs, remove
+from os.path import exists, join
+from shutil import rmtree
+from time import time
+
+# Import from itools
+from itools.database import OrQuery, PhraseQuery
+from itools.log import log_warning
+
+
+
+class OutputCache(object):
+    """Cache of the pages rendered for the anonymous users, by resource.
+    The entries are kept in memory, up to 'size_max' bytes; then the least
+    recently used are moved to the disk (if 'path' is given), up to
+    'disk_size_max' bytes.
+
+    The entries expire after 'ttl' seconds, and are dropped before when the
+    resource, one of its descendants or a resource it links to changes.
+    """
+
+    def __init__(self, size_max, ttl, path=None, disk_size_max=0):
+        self.size_max = size_max
+        self.ttl = ttl
+        # {key: (abspath, expires, etag, content_type, data)}
+        self.entries = OrderedDict()
+        self.size = 0
+        # The keys of every resource {abspath: set([key, ...])}
+        self.keys = {}
+
+        # The disk {key: (abspath, expires, etag, content_type, size)}
+        self.path = path
+        self.disk_size_max = disk_size_max
+        self.disk = OrderedDict()
+        self.disk_size = 0
+        if path is not None:
+            # The database may have changed since the last run
+            if exists(path):
+                rmtree(path)
+            makedirs(path)
+
+
+    def get_path(self, key):
+        return join(self.path, sha1(repr(key)).hexdigest())
+
+
+    def get(self, key):
+        """Returns the tuple (etag, content_type, data), or None if the key
+        is not in the cache.
+        """
+        now = time()
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            abspath, expires, etag, content_type, data = entry
+            if expires < now:
+                self.size -= len(data)
+                self._unindex(key, abspath)
+                return None
+            # Mark the entry as recently used
+            self.entries[key] = entry
+            return etag, content_type, data
+
+        # The disk
+        entry = self.disk.pop(key, None)
+        if entry is None:
+            return None
+
+        abspath, expires, etag, content_type, size = entry
+        self.disk_size -= size
+        path = self.get_path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            remove(path)
+        except (IOError, OSError):
+            data = None
+        if data is None or expires < now:
+            self._unindex(key, abspath)
+            return None
+
+        # Back to memory
+        self.entries[key] = (abspath, expires, etag, content_type, data)
+        self.size += len(data)
+        self._evict()
+        return etag, content_type, data
+
+
+    def set(self, key, abspath, content_type, data):
+        """Adds the page to the cache, returns its entity tag.
+        """
+        self.remove(key)
+
+        etag = '"%s"' % sha1(data).hexdigest()
+        expires = time() + self.ttl
+        self.entries[key] = (abspath, expires, etag, content_type, data)
+        self.size += len(data)
+        self.keys.setdefault(abspath, set()).add(key)
+        self._evict()
+        return etag
+
+
+    def _evict(self):
+        while self.size > self.size_max and self.entries:
+            key, entry = self.entries.popitem(last=False)
+            abspath, expires, etag, content_type, data = entry
+            self.size -= len(data)
+            if self.path is None or len(data) > self.disk_size_max:
+                self._unindex(key, abspath)
+                continue
+
+            # Move to the disk
+            try:
+                with open(self.get_path(key), 'wb') as file:
+                    file.write(data)
+            except (IOError, OSError):
+                log_warning('output cache: could not write %s' % abspath,
+                            domain='ikaaro')
+                self._unindex(key, abspath)
+                continue
+            self.disk[key] = (abspath, expires, etag, content_type, len(data))
+            self.disk_size += len(data)
+
+        while self.disk_size > self.disk_size_max and self.disk:
+            key, entry = self.disk.popitem(last=False)
+            self._remove_file(key, entry)
+
+
+    def _unindex(self, key, abspath):
+        keys = self.keys.get(abspath)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys[abspath]
+
+
+    def _remove_file(self, key, entry):
+        abspath, expires, etag, content_type, size = entry
+        self.disk_size -= size
+        self._unindex(key, abspath)
+        try:
+            remove(self.get_path(key))
+        except OSError:
+            pass
+
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[4])
+            self._unindex(key, entry[0])
+            return
+
+        entry = self.disk.pop(key, None)
+        if entry is not None:
+            self._remove_file(key, entry)
+
+
+    def invalidate(self, abspaths):
+        """Removes the pages of the given resources.
+        """
+        for abspath in abspaths:
+            for key in list(self.keys.get(abspath, ())):
+                self.remove(key)
+
+
+    def clear(self):
+        for key, entry in self.disk.items():
+            self._remove_file(key, entry)
+        self.disk.clear()
+        self.entries.clear()
+        self.keys.clear()
+        self.size = 0
+        self.disk_size = 0
+
+
+    def on_commit(self, database, paths):
+        # The configuration (menu, theme, footer, access rules, etc.) is
+        # shown by every page
+        for path in paths:
+            if path == '/config' or path.startswith('/config/'):
+                self.clear()
+                return
+
+        # The resources changed and the folders that list them
+        abspaths = set()
+        for path in paths:
+            while path not in abspaths:
+                abspaths.add(path)
+                path = path.rsplit('/', 1)[0] or '/'
+
+        # The resources that link to them
+        paths = list(paths)
+        for n in range(0, len(paths), 200):
+            query = [ PhraseQuery('links', x) for x in paths[n:n+200] ]
+            for brain in database.search(OrQuery(*query)).get_documents():
+                abspaths.add(brain.abspath)
+
+        self.invalidate(abspaths)
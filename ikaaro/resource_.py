@@ -58,7 +58,7 @@ from rest import Rest_Login, Rest_Schema, Rest_Query
 from rest import Rest_Create, Rest_Read, Rest_Update, Rest_Delete
 from revisions_views import DBResource_CommitLog, DBResource_Changes
 from update import class_version_to_date
-from utils import get_base_path_query
+from utils import get_base_path_query, get_handler_blob_id, get_links_query
 
 
 
@@ -95,6 +95,7 @@ class DBResource(Resource):
     description = Textarea_Field(indexed=True, title=MSG(u'Description'))
     subject = Text_Field(indexed=True, title=MSG(u'Keywords'))
     share = Share_Field
+    rank = Char_Field(indexed=True, stored=True, readonly=True)
 
 
     def __init__(self, metadata):
@@ -265,22 +266,44 @@ class DBResource(Resource):
 
         # Referential action
         if ref_action == 'restrict':
-            # Check referencial-integrity
+            # Check referencial-integrity, search the resources linking to
+            # this resource or to any resource within it
             path = str(resource.abspath)
-            query = AndQuery(NotQuery(PhraseQuery('abspath', path)),
-                             NotQuery(get_base_path_query(path)))
-            sub_search = database.search(query)
-            for sub_resource in resource.traverse_resources():
-                path = str(sub_resource.abspath)
-                query = PhraseQuery('links', path)
-                results = sub_search.search(query)
-                # A resource may have been updated in the same transaction,
-                # so not yet reindexed: we need to check that the resource
-                # really links.
-                for referrer in results.get_resources():
-                    if path in referrer.get_links():
-                        err = 'cannot delete, resource "{}" is referenced'
-                        raise ConsistencyError(err.format(path))
+            prefix = '%s/' % path
+            old2new = database.resources_old2new
+            new2old = database.resources_new2old
+            # The abspaths of the subtree, from the catalog and from the
+            # current transaction
+            subtree = database.search(get_base_path_query(path))
+            paths = set([ x.abspath for x in subtree.get_documents() ])
+            paths.update([ x for x in new2old if x.startswith(prefix) ])
+            paths.add(path)
+            paths = sorted(paths)
+            not_subtree = AndQuery(NotQuery(PhraseQuery('abspath', path)),
+                                   NotQuery(get_base_path_query(path)))
+            # Search the referrers by pages of abspaths ('links' is a
+            # multiple field, it does not support prefix queries)
+            for n in range(0, len(paths), 200):
+                query = AndQuery(get_links_query(*paths[n:n+200]),
+                                 not_subtree)
+                for brain in database.search(query).get_documents():
+                    # A resource may have been updated in the same
+                    # transaction, so not yet reindexed: we need to check
+                    # that the resource really links.
+                    referrer = old2new.get(brain.abspath, brain.abspath)
+                    if referrer is None:
+                        continue
+                    links = None
+                    if referrer not in new2old:
+                        # Catalogs made by older versions do not store the
+                        # links
+                        links = brain.links
+                    if links is None:
+                        links = self.get_resource(referrer).get_links()
+                    for link in links:
+                        if link == path or link.startswith(prefix):
+                            err = 'cannot delete, resource "{}" is referenced'
+                            raise ConsistencyError(err.format(link))
         elif ref_action == 'force':
             # Do not check referencial-integrity
             pass
@@ -574,6 +597,7 @@ class DBResource(Resource):
             if class_id:
                 values['base_classes'].append(class_id)
         values['class_version'] = class_version_to_date(self.metadata.version)
+        values['metadata_blob_id'] = get_handler_blob_id(self.metadata)
 
         # Links to other resources
         values['owner'] = self.get_owner()
@@ -649,26 +673,17 @@ class DBResource(Resource):
 
 
     def _on_move_resource(self, source):
-        """This method updates the links from/to other resources.  It is
-        called when the resource has been moved and/or renamed.
+        """This method updates the links from this resource to other
+        resources.  It is called when the resource has been moved and/or
+        renamed.
 
         This method is called by 'Database._before_commit', the 'source'
-        parameter is the place the resource has been moved from.
+        parameter is the place the resource has been moved from.  The
+        resources that link to this one are updated afterwards, all at
+        once, see 'update_links_map'.
         """
-        # (1) Update links to other resources
         self.update_incoming_links(Path(source))
 
-        # (2) Update resources that link to me
-        database = self.database
-        target = self.abspath
-        query = PhraseQuery('links', source)
-        results = database.search(query).get_documents()
-        for result in results:
-            path = result.abspath
-            path = database.resources_old2new.get(path, path)
-            resource = self.get_resource(path)
-            resource.update_links(source, target)
-
 
     def get_links(self):
         # Automatically from the fields
@@ -694,6 +709,14 @@ class DBResource(Resource):
 
         The parameters 'source' and 'target' are absolute 'Path' objects.
         """
+        self.update_links_map({str(source): target})
+
+
+    def update_links_map(self, links_map):
+        """Same as 'update_links' for several resources moved at once:
+        'links_map' maps their old absolute paths (strings) to the new ones
+        ('Path' objects).  Every field is rewritten in a single pass.
+        """
         base = str(self.abspath)
         old_base = self.database.resources_new2old.get(base, base)
         old_base = Path(old_base)
@@ -703,8 +726,8 @@ class DBResource(Resource):
         for field_name in self.fields:
             field = self.get_field(field_name)
             if field:
-                field.update_links(self, field_name, source, target,
-                                   languages, old_base, new_base)
+                field.update_links_map(self, field_name, links_map,
+                                       languages, old_base, new_base)
         self.reindex()
 
 
@@ -907,8 +930,10 @@ register_field('name', String(stored=True, indexed=True))
 register_field('format', String(indexed=True, stored=True))
 register_field('base_classes', String(multiple=True, indexed=True))
 register_field('class_version', Date(indexed=True, stored=True))
+# Used to find out the documents that are not up-to-date
+register_field('metadata_blob_id', String(stored=True))
 # Referential integrity
-register_field('links', String(multiple=True, indexed=True))
+register_field('links', String(multiple=True, indexed=True, stored=True))
 register_field('onchange_reindex', String(multiple=True, indexed=True))
 # Full text search
 register_field('text', Unicode(indexed=True))
@@ -19,6 +19,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+# Import from the Standard Library
+from os.path import getsize, isfile
+
 # Import from itools
 from itools.core import guess_extension, merge_dicts
 from itools.database import OrQuery, PhraseQuery
@@ -37,6 +40,9 @@ from emails import send_email
 from exceptions import ConsistencyError
 from folder_views import Folder_BrowseContent
 from messages import MSG_LOGIN_WRONG_NAME_OR_PASSWORD
+from thumbnails import get_thumbnail
+from utils import get_handler_blob_id, get_handler_path, get_links_query
+from utils import parse_http_range
 
 
 
@@ -71,6 +77,9 @@ class DBResource_GetFile(BaseView):
 
     query_schema = {'name': String}
     field_name = None
+    # Maximum number of bytes sent in answer to a range request, clients
+    # ask for the rest with further requests
+    max_range_size = 8 * 2**20
 
 
     def get_field_name(self, context=None):
@@ -107,6 +116,24 @@ class DBResource_GetFile(BaseView):
         return '%s.%s%s' % (resource.name, field_name, extension)
 
 
+    def is_not_modified(self, context, etag):
+        """Sets the ETag header, and returns True if the client already has
+        this version of the file (If-None-Match), then the status is set to
+        304.
+        """
+        context.set_header('ETag', etag)
+        if_none_match = context.get_header('If-None-Match')
+        if not if_none_match:
+            return False
+
+        tags = [ x.strip() for x in if_none_match.split(',') ]
+        if '*' in tags or etag in tags or ('W/' + etag) in tags:
+            # 304 Not Modified
+            context.status = 304
+            return True
+        return False
+
+
     def GET(self, resource, context):
         field_name = self.get_field_name(context)
         handler = self.get_handler(resource, field_name)
@@ -122,8 +149,51 @@ class DBResource_GetFile(BaseView):
         filename = self.get_filename(handler, field_name, resource)
         context.set_content_disposition(disposition, filename)
 
+        # ETag (strong, the git blob id)
+        etag = '"%s"' % get_handler_blob_id(handler)
+        context.set_header('Accept-Ranges', 'bytes')
+        if self.is_not_modified(context, etag):
+            return ''
+
+        # The handler has been modified in this transaction, or does not
+        # have a file: serve it from memory
+        path = get_handler_path(handler)
+        if handler.dirty or path is None or not isfile(path):
+            data = handler.to_str()
+            size = len(data)
+        else:
+            data = None
+            size = getsize(path)
+
+        # Range
+        range = context.get_header('Range')
+        if_range = context.get_header('If-Range')
+        if range and (not if_range or if_range.strip() == etag):
+            try:
+                range = parse_http_range(range, size)
+            except ValueError:
+                # 416 Requested Range Not Satisfiable
+                context.status = 416
+                context.set_header('Content-Range', 'bytes */%d' % size)
+                return ''
+            if range:
+                first, last = range
+                last = min(last, first + self.max_range_size - 1)
+                # 206 Partial Content
+                context.status = 206
+                context.set_header('Content-Range',
+                                   'bytes %d-%d/%d' % (first, last, size))
+                if data is not None:
+                    return data[first:last + 1]
+                with open(path, 'rb') as file:
+                    file.seek(first)
+                    return file.read(last - first + 1)
+
         # Ok
-        return handler.to_str()
+        if data is not None:
+            return data
+        with open(path, 'rb') as file:
+            return file.read()
 
 
 
@@ -136,6 +206,9 @@ class DBResource_GetImage(DBResource_GetFile):
         'fit': Boolean(default=False),
         'lossy': Boolean(default=False)}
 
+    # Number of seconds the thumbnails may be cached by the clients
+    max_age = 600
+
 
     def GET(self, resource, context):
         field_name = self.get_field_name(context)
@@ -150,7 +223,13 @@ class DBResource_GetImage(DBResource_GetFile):
         format = 'jpeg'
         if lossy is False:
             format = handler.get_mimetype().split('/')[1]
-        data, format = handler.get_thumbnail(width, height, format, fit)
+        # ETag, the thumbnail is identified by the image and the parameters
+        etag = '"%s-%sx%s-%s-%d"' % (get_handler_blob_id(handler), width,
+                                     height, format, fit)
+        if self.is_not_modified(context, etag):
+            return ''
+
+        data, format = get_thumbnail(handler, width, height, format, fit)
         if data is None:
             default = context.get_template('/ui/icons/48x48/image.png')
             data = default.to_str()
@@ -158,6 +237,11 @@ class DBResource_GetImage(DBResource_GetFile):
 
         # Headers
         context.set_content_type('image/%s' % format)
+        # Browsers and proxies can keep the thumbnail for a while, and then
+        # revalidate it with the ETag (shared caches only for anonymous)
+        public = 'public' if context.user is None else 'private'
+        context.set_header('Cache-Control',
+                           '%s, max-age=%d' % (public, self.max_age))
 #       filename = resource.get_value('filename')
 #       if filename:
 #           context.set_content_disposition('inline', filename)
@@ -205,7 +289,7 @@ class DBResource_Backlinks(DBResource_Links):
     title = MSG(u"Backlinks")
 
     def get_items(self, resource, context):
-        return context.search(links=str(resource.abspath))
+        return context.search(get_links_query(resource.abspath))
 
 
 
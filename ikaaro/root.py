@@ -77,9 +77,13 @@ class CtrlView(BaseView):
     def GET(self, resource, context):
         context.content_type = 'text/plain'
         database = context.database
-        return dumps(
-            {'packages': resource.get_version_of_packages(context),
-             'read-only': not isinstance(database, RWDatabase)})
+        namespace = {
+            'packages': resource.get_version_of_packages(context),
+            'read-only': not isinstance(database, RWDatabase)}
+        server = context.server
+        if server is not None:
+            namespace['spool'] = server.mail_spool.get_stats()
+        return dumps(namespace)
 
 
 
@@ -339,9 +343,11 @@ class Root(Folder):
 
     ########################################################################
     # Email
-    def send_email(self, to_addr, subject, reply_to=None, text=None,
-                   html=None, encoding='utf-8', subject_with_host=True,
-                   return_receipt=False, attachment=None):
+    def get_email(self, to_addr, subject, reply_to=None, text=None,
+                  html=None, encoding='utf-8', subject_with_host=True,
+                  return_receipt=False, attachment=None):
+        """Returns the email message, see 'send_email'.
+        """
         # 1. Check input data
         if type(subject) is unicode:
             subject = subject.encode(encoding)
@@ -439,8 +445,39 @@ class Root(Folder):
                                           filename=attachment.name)
             message.attach(message_attachment)
 
-        # 6. Send email
-        server.send_email(message)
+        return message
+
+
+    def send_email(self, to_addr, subject, reply_to=None, text=None,
+                   html=None, encoding='utf-8', subject_with_host=True,
+                   return_receipt=False, attachment=None):
+        message = self.get_email(to_addr, subject, reply_to, text, html,
+                                 encoding, subject_with_host, return_receipt,
+                                 attachment)
+        get_context().server.send_email(message)
+
+
+    # Maximum number of recipients of a bulk email
+    bulk_email_size = 100
+
+    def send_bulk_email(self, to_addrs, subject, reply_to=None, text=None,
+                        html=None, encoding='utf-8', subject_with_host=True):
+        """Sends the same email to the given list of addresses, the
+        recipients do not see each other.  The email is built once, and
+        spooled once for every 'bulk_email_size' recipients.
+        """
+        if not to_addrs:
+            return
+
+        message = self.get_email('undisclosed-recipients:;', subject,
+                                 reply_to, text, html, encoding,
+                                 subject_with_host)
+        server = get_context().server
+        size = self.bulk_email_size
+        for i in range(0, len(to_addrs), size):
+            del message['Bcc']
+            message['Bcc'] = ', '.join(to_addrs[i:i+size])
+            server.send_email(message)
 
 
     #######################################################################
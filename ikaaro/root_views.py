@@ -33,7 +33,7 @@ from itools.handlers import get_handler_class_by_mimetype
 from itools.html import XHTMLFile
 from itools.stl import rewrite_uris
 from itools.uri import get_reference
-from itools.web import BaseView, FormError, STLView, INFO
+from itools.web import BaseView, FormError, STLView, ERROR, INFO
 from itools.xml import get_element, TEXT
 
 # Import from ikaaro
@@ -320,8 +320,14 @@ class UpdateDocs(AutoForm):
         filename, mimetype, body = form['file']
         cls = get_handler_class_by_mimetype(mimetype)
         handler = cls(string=body)
-        docs.extract_archive(handler, language, filter, postproc, True)
+        errors = docs.extract_archive(handler, language, filter, postproc,
+                                      True)
 
         # Ok
-        message = MSG(u'Documentation updated.')
+        if errors:
+            paths = ', '.join([ x for x, error in errors ])
+            message = ERROR(u'Some files could not be extracted: {paths}')
+            message = message(paths=paths)
+        else:
+            message = MSG(u'Documentation updated.')
         return context.come_back(message, goto='./docs')
@@ -23,6 +23,7 @@ from itools.core import fixed_offset
 from itools.fs.common import get_mimetype
 from itools.uri import Path
 from itools.web.utils import set_response
+from itools.web import DatabaseRouter
 from itools.web.router import BaseRouter, RequestMethod
 
 
@@ -61,3 +62,77 @@ class GET_STATIC_CACHED(RequestMethod):
 class StaticCachedRouter(BaseRouter):
 
     methods = {'GET': GET_STATIC_CACHED}
+
+
+
+def get_output_cache_key(context):
+    """The pages of the anonymous users depend on the URI (the skin too, it
+    is chosen from the host name, the view and the query), and on the
+    language of the page: the one of the cookie, or else the website
+    language that best matches the preferences of the browser.
+    """
+    uri = context.uri
+    query = sorted([ (x, str(y)) for x, y in uri.query.items() ])
+    language = context.get_cookie('language')
+    if not language:
+        languages = context.root.get_value('website_languages')
+        language = context.accept_language.select_language(languages)
+    return (uri.scheme, uri.authority, str(uri.path), tuple(query), language)
+
+
+
+class GET_OUTPUT_CACHED(DatabaseRouter.methods['GET']):
+
+    @classmethod
+    def handle_request(cls, context):
+        cache = context.server.output_cache
+        # Only anonymous requests
+        if (cache is None or context.user is not None or context.cookies
+                or context.soup_message.get_header('range')):
+            return super(GET_OUTPUT_CACHED, cls).handle_request(context)
+
+        key = get_output_cache_key(context)
+        entry = cache.get(key)
+        if entry is None:
+            super(GET_OUTPUT_CACHED, cls).handle_request(context)
+            if cls.is_cacheable(context):
+                abspath = str(context.resource.abspath)
+                etag = cache.set(key, abspath, context.content_type,
+                                 context.entity)
+                context.set_header('ETag', etag)
+            return
+
+        # 304 Not Modified
+        etag, content_type, data = entry
+        context.set_header('ETag', etag)
+        if context.soup_message.get_header('if-none-match') == etag:
+            return set_response(context.soup_message, 304)
+
+        # 200 Ok
+        if context.server.accept_cors:
+            context.accept_cors()
+        context.soup_message.set_status(200)
+        context.soup_message.set_response(content_type, data)
+
+
+    @classmethod
+    def is_cacheable(cls, context):
+        """Only the HTML pages rendered for the anonymous users, unless the
+        view says otherwise.
+        """
+        if context.status != 200 or type(context.entity) is not str:
+            return False
+        if context.user is not None or context.cookies:
+            return False
+        content_type = context.content_type or ''
+        if not content_type.startswith('text/html'):
+            return False
+        if context.resource is None:
+            return False
+        return getattr(context.view, 'cache_output', True)
+
+
+
+class OutputCachedRouter(DatabaseRouter):
+
+    methods = dict(DatabaseRouter.methods, GET=GET_OUTPUT_CACHED)
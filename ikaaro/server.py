@@ -19,48 +19,53 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # Import from the Standard Library
-from datetime import timedelta
-from email.parser import HeaderParser
+from datetime import datetime, timedelta
 import json
+from multiprocessing import Process, Queue
 import pickle
-from os import fdopen, getpgid, getpid, kill, mkdir, remove
+from os import getpgid, getpid, kill, mkdir, remove, rename, walk
 from os.path import join
 from psutil import pid_exists
+from Queue import Empty
 import sys
 from time import time
 from traceback import format_exc
-from smtplib import SMTP, SMTPRecipientsRefused, SMTPResponseException
 from signal import SIGINT, SIGTERM
-from socket import gaierror
-from tempfile import mkstemp
 
 # Import from pygobject
 from glib import GError
 
 # Import from itools
-from itools.core import become_daemon, get_abspath, vmsize
-from itools.database import Metadata, RangeQuery
-from itools.database import make_catalog, Resource, get_register_fields
+from itools.core import become_daemon, fixed_offset, get_abspath, vmsize
+from itools.database import AllQuery, Metadata, OrQuery, PhraseQuery
+from itools.database import RangeQuery
+from itools.database import Catalog, make_catalog, Resource
+from itools.database import get_register_fields
 from itools.database import check_database
 from itools.datatypes import Boolean, Email, Integer, String, Tokens
 from itools.fs import vfs, lfs
 from itools.handlers import ConfigFile, ro_database
 from itools.log import Logger, register_logger
 from itools.log import DEBUG, INFO, WARNING, ERROR, FATAL
-from itools.log import log_error, log_warning, log_info
+from itools.log import log_error, log_warning
 from itools.loop import Loop, cron
+from itools.uri import Path
 from itools.web import WebServer, WebLogger
 from itools.web import set_context, get_context
 from itools.web import SoupMessage, StaticRouter, DatabaseRouter
 
 # Import from ikaaro
 from context import CMSContext
-from database import get_database, make_database
+from database import get_database, make_database, register_commit_hook
 from datatypes import ExpireValue
+from output_cache import OutputCache
 from root import Root
-from router import StaticCachedRouter
+from router import OutputCachedRouter, StaticCachedRouter
 from update import is_instance_up_to_date
+from utils import get_file_blob_id
 from skins import skin_registry
+from spool import MailSpool
+from thumbnails import ThumbnailStore
 
 
 
@@ -88,10 +93,14 @@ listen-port = {listen_port}
 # The "smtp-login" and "smtp-password" variables define the credentials
 # required to access a secured SMTP server.
 #
+# The "smtp-batch-size" variable defines the maximum number of emails sent
+# at once through the same SMTP connection (by default 50).
+#
 smtp-host = {smtp_host}
 smtp-from = {smtp_from}
 smtp-login =
 smtp-password =
+smtp-batch-size = 50
 
 # The "log-level" variable may have one of these values (from lower to
 # higher verbosity): 'critical' 'error', 'warning', 'info' and 'debug'.
@@ -102,11 +111,15 @@ smtp-password =
 log-level = warning
 log-email = {log_email}
 
-# The "cron-interval" variable defines the number of seconds between every
-# call to the cron job manager. If zero (the default) the cron job won't be
-# run at all.
+# The "cron-interval" variable defines the maximum number of seconds between
+# two calls to the cron job manager, which otherwise wakes up when the next
+# time event is due. If zero (the default) the cron job won't be run at all.
+#
+# The "cron-batch-size" variable defines the number of time events run in
+# one transaction (by default 100).
 #
 cron-interval = 0
+cron-batch-size = 100
 
 # If the "session-timeout" variable is different from zero (the default), the
 # user will be automatically logged out after the specified number of minutes.
@@ -141,6 +154,27 @@ accept-cors = 0
 #
 max-width =
 max-height =
+
+# The "thumbnails-size" variable defines the maximum size, in megabytes, of
+# the thumbnails kept on disk (in the "thumbnails" folder).  When the limit
+# is reached the least recently used thumbnails are removed.  Set this
+# option to 0 to disable the thumbnails store (default is 100).
+#
+thumbnails-size = 100
+
+# The "output-cache-size" variable defines the maximum size, in megabytes,
+# of the pages rendered for the anonymous users kept in memory.  Set this
+# option to 0 to disable the output cache (the default).  The pages expire
+# after "output-cache-ttl" seconds (default is 300), or before if they
+# change.
+#
+# The "output-cache-disk-size" variable defines the maximum size, in
+# megabytes, of the pages moved from memory to disk (in the "cache/output"
+# folder).  Set this option to 0 to keep the pages only in memory (default).
+#
+output-cache-size = 0
+output-cache-ttl = 300
+output-cache-disk-size = 0
 """)
 
 
@@ -299,6 +333,8 @@ class ServerLoop(Loop):
 class Server(WebServer):
 
     timestamp = None
+    thumbnails = None
+    output_cache = None
 
     def __init__(self, target, read_only=False, cache_size=None,
                  profile_space=False):
@@ -334,6 +370,7 @@ class Server(WebServer):
         else:
             size_min = size_max = cache_size
         size_min, size_max = int(size_min), int(size_max)
+        self.database_size = size_min, size_max
         read_only = read_only or config.get_value('database-readonly')
         database = get_database(target, size_min, size_max, read_only)
         self.database = database
@@ -351,15 +388,16 @@ class Server(WebServer):
 
         # Email service
         self.spool = lfs.resolve2(self.target, 'spool')
-        spool_failed = '%s/failed' % self.spool
-        if not lfs.exists(spool_failed):
-            lfs.make_folder(spool_failed)
         # Configuration variables
         get_value = config.get_value
         self.smtp_host = get_value('smtp-host')
         self.smtp_login = get_value('smtp-login', default='').strip()
         self.smtp_password = get_value('smtp-password', default='').strip()
+        self.mail_spool = MailSpool(self.spool, self.smtp_host,
+                                    self.smtp_login, self.smtp_password,
+                                    get_value('smtp-batch-size'))
         # Email is sent asynchronously
+        self.spool_scheduled = False
         self.flush_spool()
 
         # Logging
@@ -377,6 +415,22 @@ class Server(WebServer):
         # Session timeout
         self.session_timeout = get_value('session-timeout')
 
+        # Thumbnails
+        thumbnails_size = get_value('thumbnails-size')
+        if thumbnails_size:
+            path = '%s/thumbnails' % target
+            self.thumbnails = ThumbnailStore(path, thumbnails_size * 2**20)
+
+        # Output cache
+        output_cache_size = get_value('output-cache-size')
+        if output_cache_size:
+            disk_size = get_value('output-cache-disk-size')
+            path = ('%s/cache/output' % target) if disk_size else None
+            self.output_cache = OutputCache(output_cache_size * 2**20,
+                                            get_value('output-cache-ttl'),
+                                            path, disk_size * 2**20)
+            register_commit_hook(self.output_cache.on_commit)
+
 
     def check_consistency(self, quick):
         # Check the server is not running
@@ -411,6 +465,9 @@ class Server(WebServer):
         # Update Git tree-cache, to speed things up
         self.database.worktree.update_tree_cache()
 
+        # Release the emails claimed by a sender that did not finish
+        self.mail_spool.release_locks()
+
         # Find out the IP to listen to
         address = self.config.get_value('listen-address').strip()
         if not address:
@@ -426,7 +483,10 @@ class Server(WebServer):
         # Listen & set context
         root = self.root
         self.listen(address, port)
-        self.set_router('/', DatabaseRouter)
+        if self.output_cache is None:
+            self.set_router('/', DatabaseRouter)
+        else:
+            self.set_router('/', OutputCachedRouter)
 
         # Call method on root at start
         context = get_context()
@@ -435,7 +495,8 @@ class Server(WebServer):
         # Set cron interval
         interval = self.config.get_value('cron-interval')
         if interval:
-            cron(self.cron_manager, interval)
+            register_commit_hook(self.cron_on_commit)
+            self.schedule_cron(interval)
 
         # Run
         profile = ('%s/log/profile' % self.target) if profile else None
@@ -449,55 +510,96 @@ class Server(WebServer):
         return True
 
 
-    def reindex_catalog(self, quiet=False, quick=False, as_test=False):
+    def reindex_catalog(self, quiet=False, quick=False, as_test=False,
+                        jobs=1, resume=False, checkpoint=0, max_memory=None):
+        """Rebuilds the catalog into 'catalog.new', then replaces the old
+        catalog with it.
+
+        If 'checkpoint' is given the new catalog is committed every
+        'checkpoint' documents, and the last indexed abspath is recorded,
+        so an interrupted rebuild can be continued with 'resume'.  If
+        'max_memory' is given (in bytes) the database cache is only cleaned
+        when the process uses more memory than that.
+        """
         if self.is_running_in_rw_mode():
             print 'Cannot proceed, the server is running in read-write mode.'
             return
+        # Checkpoints rely on the traversal order, the workers do not follow
+        # any order
+        if jobs > 1:
+            if resume:
+                raise ValueError, 'cannot resume with jobs > 1'
+            checkpoint = 0
         # Check for database consistency
         if quick is False and check_database(self.target) is False:
             return False
-        # Create a temporary new catalog
+        # Resume from the last checkpoint, if any
         catalog_path = '%s/catalog.new' % self.target
-        if lfs.exists(catalog_path):
-            lfs.remove(catalog_path)
-        catalog = make_catalog(catalog_path, get_register_fields())
-
-        # Get the root
-        root = self.root
+        resume_from, doc_n = None, 0
+        if resume:
+            resume_from, doc_n = self._load_reindex_checkpoint()
+            if resume_from is None:
+                print '[Update] No checkpoint found, starting from scratch'
+        if resume_from is not None:
+            print '[Update] Resuming after %s (%d documents)' % (resume_from,
+                                                                 doc_n)
+            catalog = Catalog(catalog_path, get_register_fields())
+        else:
+            # Create a temporary new catalog
+            if lfs.exists(catalog_path):
+                lfs.remove(catalog_path)
+            catalog = make_catalog(catalog_path, get_register_fields())
 
         # Build a fake context
         context = self.get_fake_context()
 
         # Update
         t0, v0 = time(), vmsize()
-        doc_n = 0
         error_detected = False
         if as_test:
-            log = open('%s/log/update-catalog' % self.target, 'w').write
-        for obj in root.traverse_resources():
-            if not isinstance(obj, Resource):
-                continue
-            if not quiet:
-                print doc_n, obj.abspath
-            doc_n += 1
-            context.resource = obj
-
-            # Index the document
-            try:
-                catalog.index_document(obj)
-            except Exception:
-                if as_test:
-                    error_detected = True
-                    log('*** Error detected ***\n')
-                    log('Abspath of the resource: %r\n\n' % str(obj.abspath))
-                    log(format_exc())
-                    log('\n')
-                else:
-                    raise
+            mode = 'w' if resume_from is None else 'a'
+            log = open('%s/log/update-catalog' % self.target, mode).write
+        if jobs > 1:
+            documents = self._get_catalog_values_parallel(jobs)
+        else:
+            documents = self._get_catalog_values(context, as_test,
+                                                 resume_from, max_memory)
+        try:
+            for abspath, values, error in documents:
+                if not quiet:
+                    print doc_n, abspath
+                doc_n += 1
+
+                # Index the document
+                if error is None:
+                    try:
+                        catalog.index_document(values)
+                    except Exception:
+                        if not as_test:
+                            raise
+                        error = format_exc()
+
+                if error is not None:
+                    if as_test:
+                        error_detected = True
+                        log('*** Error detected ***\n')
+                        log('Abspath of the resource: %r\n\n' % abspath)
+                        log(error)
+                        log('\n')
+                    else:
+                        print error
+                        raise RuntimeError, 'failed to index %r' % abspath
+
+                # Checkpoint
+                if checkpoint and doc_n % checkpoint == 0:
+                    catalog.save_changes()
+                    self._save_reindex_checkpoint(abspath, doc_n)
+        finally:
+            # Stop the workers, if any
+            documents.close()
 
-            # Free Memory
-            del obj
-            self.database.make_room()
+        # Done, the checkpoint is not needed anymore
+        self._remove_reindex_checkpoint()
 
         if not error_detected:
             if as_test:
@@ -529,6 +631,225 @@ class Server(WebServer):
             return False
 
 
+    def reindex_stale_documents(self, quiet=False):
+        """Updates the catalog in place: indexes the resources that are
+        missing from the catalog or whose metadata file changed since they
+        were indexed (and the resources that depend on them), and removes
+        the documents of the resources that do not exist anymore.
+        """
+        if self.is_running_in_rw_mode():
+            print 'Cannot proceed, the server is running in read-write mode.'
+            return
+        t0 = time()
+        catalog = Catalog('%s/catalog' % self.target, get_register_fields())
+        context = self.get_fake_context()
+
+        # 1. Compare the catalog with the metadata files
+        indexed = {}
+        for brain in catalog.search(AllQuery()).get_documents():
+            indexed[brain.abspath] = getattr(brain, 'metadata_blob_id', None)
+        n_documents = len(indexed)
+        missing = []
+        stale = []
+        not_committed = 0
+        for abspath, blob_id, git_blob_id in self._get_metadata_blob_ids():
+            if blob_id != git_blob_id:
+                not_committed += 1
+            if abspath not in indexed:
+                missing.append(abspath)
+            elif indexed.pop(abspath) != blob_id:
+                stale.append(abspath)
+        orphans = indexed.keys()
+
+        # 2. The documents that depend on the changed ones
+        changed = set(missing) | set(stale) | set(orphans)
+        dependents = set()
+        aux = list(changed)
+        for n in range(0, len(aux), 200):
+            query = OrQuery(*[ PhraseQuery('onchange_reindex', x)
+                               for x in aux[n:n+200] ])
+            for brain in catalog.search(query).get_documents():
+                dependents.add(brain.abspath)
+        dependents.difference_update(changed)
+
+        # 3. Report
+        print '[Drift] Catalog: %d documents' % n_documents
+        print '[Drift] Missing: %d' % len(missing)
+        print '[Drift] Stale: %d' % len(stale)
+        print '[Drift] Orphaned: %d' % len(orphans)
+        print '[Drift] Dependents: %d' % len(dependents)
+        print '[Drift] Not committed: %d' % not_committed
+
+        # 4. Update
+        for abspath in orphans:
+            if not quiet:
+                print '-', abspath
+            catalog.unindex_document(abspath)
+
+        database = self.database
+        to_index = sorted(set(missing) | set(stale) | dependents)
+        for abspath in to_index:
+            if not quiet:
+                print '+', abspath
+            resource = database.get_resource(abspath, soft=True)
+            if resource is None:
+                continue
+            context.resource = resource
+            catalog.unindex_document(abspath)
+            catalog.index_document(resource.get_catalog_values())
+            # Free Memory
+            del resource
+            database.make_room()
+
+        catalog.save_changes()
+        print '[Update] Time: %.02f seconds' % (time() - t0)
+        return True
+
+
+    def _get_metadata_blob_ids(self):
+        """Yields a tuple (abspath, blob id, git blob id) for every metadata
+        file in the database, where the blob id is the one of the file and
+        the git blob id the one in the Git index (None if not there).
+        """
+        index = self.database.worktree.index
+        root = '%s/database' % self.target
+        n = len(root)
+        for dirpath, dirnames, filenames in walk(root):
+            if dirpath == root and '.git' in dirnames:
+                dirnames.remove('.git')
+            for filename in filenames:
+                if filename[-9:] != '.metadata':
+                    continue
+                path = join(dirpath, filename)
+                key = path[n+1:]
+                git_blob_id = index[key].oid.hex if key in index else None
+                yield path[n:-9] or '/', get_file_blob_id(path), git_blob_id
+
+
+    def _get_catalog_values(self, context, as_test=False, resume_from=None,
+                            max_memory=None):
+        """Traverses the database and yields a tuple (abspath, values, error)
+        for every resource, where values are the catalog values and error
+        is the traceback if they could not be computed.
+        """
+        if resume_from is not None:
+            resume_from = list(Path(resume_from))
+
+        database = self.database
+        for obj in self._traverse_resources(self.root, resume_from):
+            if not isinstance(obj, Resource):
+                continue
+            context.resource = obj
+            try:
+                yield str(obj.abspath), obj.get_catalog_values(), None
+            except Exception:
+                if not as_test:
+                    raise
+                yield str(obj.abspath), None, format_exc()
+
+            # Free Memory
+            del obj
+            if max_memory is None or vmsize() > max_memory:
+                database.make_room()
+
+
+    def _traverse_resources(self, resource, after=None):
+        """Same as 'resource.traverse_resources()', but the children are
+        visited sorted by name, so the order is the same from one run to
+        the next.  If 'after' is given (the list of segments of an abspath),
+        the resources up to it, included, are skipped.
+        """
+        abspath = list(resource.abspath)
+        if after is None or abspath > after:
+            yield resource
+
+        for name in sorted(resource._get_names()):
+            path = abspath + [name]
+            if after is not None and path < after:
+                # The whole subtree comes before 'after'
+                if path != after[:len(path)]:
+                    continue
+            child = resource.get_resource(name)
+            for x in self._traverse_resources(child, after):
+                yield x
+
+
+    def _save_reindex_checkpoint(self, abspath, doc_n):
+        path = '%s/catalog.new.checkpoint' % self.target
+        with open(path + '.tmp', 'w') as file:
+            file.write('%s\n%d\n' % (abspath, doc_n))
+        rename(path + '.tmp', path)
+
+
+    def _load_reindex_checkpoint(self):
+        path = '%s/catalog.new.checkpoint' % self.target
+        catalog_path = '%s/catalog.new' % self.target
+        if not lfs.exists(path) or not lfs.exists(catalog_path):
+            return None, 0
+
+        with open(path) as file:
+            abspath, doc_n = file.read().splitlines()
+        return abspath, int(doc_n)
+
+
+    def _remove_reindex_checkpoint(self):
+        path = '%s/catalog.new.checkpoint' % self.target
+        if lfs.exists(path):
+            remove(path)
+
+
+    def _get_reindex_tasks(self):
+        """Splits the tree in subtrees to be reindexed in parallel: every
+        task is a tuple (abspath, recursive).  The root and its children are
+        indexed alone, the subtrees start at the second level.
+        """
+        root = self.root
+        yield '/', False
+        for name in root.get_names():
+            yield '/%s' % name, False
+            for subname in root.get_names(name):
+                yield '/%s/%s' % (name, subname), True
+
+
+    def _get_catalog_values_parallel(self, jobs):
+        """Same as '_get_catalog_values' but the values are computed by
+        'jobs' worker processes, each one over its own read-only database.
+        """
+        tasks = Queue()
+        for task in self._get_reindex_tasks():
+            tasks.put(task)
+        for i in range(jobs):
+            tasks.put(None)
+
+        # The results queue is bounded so the workers do not get too far
+        # ahead of the catalog writer
+        results = Queue(1000)
+        workers = [ Process(target=reindex_worker, args=(self, tasks, results))
+                    for i in range(jobs) ]
+        for worker in workers:
+            worker.start()
+
+        try:
+            running = jobs
+            while running:
+                try:
+                    item = results.get(timeout=5)
+                except Empty:
+                    alive = [ x for x in workers if x.is_alive() ]
+                    if len(alive) < running and results.empty():
+                        raise RuntimeError, 'a reindex worker died'
+                    continue
+                if item is None:
+                    running -= 1
+                else:
+                    yield item
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+
+
     def get_pid(self):
         return get_pid('%s/pid' % self.target)
 
@@ -610,9 +931,7 @@ class Server(WebServer):
     # Mailing
     #######################################################################
     def get_spool_size(self):
-        spool = lfs.open(self.spool)
-        # We have always a 'failed' directory => "-1"
-        return len(spool.get_names()) - 1
+        return self.mail_spool.get_size()
 
 
     def save_email(self, message):
@@ -620,16 +939,14 @@ class Server(WebServer):
         if not self.smtp_host:
             raise ValueError, '"smtp-host" is not set in config.conf'
 
-        spool = lfs.resolve2(self.target, 'spool')
-        tmp_file, tmp_path = mkstemp(dir=spool)
-        file = fdopen(tmp_file, 'w')
-        try:
-            file.write(message.as_string())
-        finally:
-            file.close()
+        self.mail_spool.save(message.as_string())
 
 
     def flush_spool(self):
+        # One sender at a time
+        if self.spool_scheduled:
+            return
+        self.spool_scheduled = True
         cron(self._smtp_send, timedelta(seconds=1))
 
 
@@ -639,78 +956,16 @@ class Server(WebServer):
 
 
     def _smtp_send(self):
-        nb_max_mails_to_send = 2
-        spool = lfs.open(self.spool)
-
-        def get_names():
-            # Find out emails to send
-            locks = set()
-            names = set()
-            for name in spool.get_names():
-                if name == 'failed':
-                    # Skip "failed" special directory
-                    continue
-                if name[-5:] == '.lock':
-                    locks.add(name[:-5])
-                else:
-                    names.add(name)
-            names.difference_update(locks)
-            return names
-
-        # Send emails
-        names = get_names()
-        smtp_host = self.smtp_host
-        for name in list(names)[:nb_max_mails_to_send]:
-            # 1. Open connection
-            try:
-                smtp = SMTP(smtp_host)
-            except gaierror, excp:
-                log_warning('%s: "%s"' % (excp[1], smtp_host))
-                return 60 # 1 minute
-            except Exception:
-                self.smtp_log_error()
-                return 60 # 1 minute
-            log_info('CONNECTED to %s' % smtp_host)
-
-            # 2. Login
-            if self.smtp_login and self.smtp_password:
-                smtp.login(self.smtp_login, self.smtp_password)
-
-            # 3. Send message
-            try:
-                message = spool.open(name).read()
-                headers = HeaderParser().parsestr(message)
-                subject = headers['subject']
-                from_addr = headers['from']
-                to_addr = headers['to']
-                smtp.sendmail(from_addr, to_addr, message)
-                # Remove
-                spool.remove(name)
-                # Log
-                log_msg = 'Email "%s" sent from "%s" to "%s"'
-                log_info(log_msg % (subject, from_addr, to_addr))
-            except SMTPRecipientsRefused:
-                # The recipient addresses has been refused
-                self.smtp_log_error()
-                spool.move(name, 'failed/%s' % name)
-            except SMTPResponseException, excp:
-                # The SMTP server returns an error code
-                self.smtp_log_error()
-                spool.move(name, 'failed/%s_%s' % (excp.smtp_code, name))
-            except Exception:
-                self.smtp_log_error()
-
-            # 4. Close connection
-            smtp.quit()
-
-        # Is there something left?
-        return 60 if get_names() else False
-
-
-    def smtp_log_error(self):
-        summary = 'Error sending email\n'
-        details = format_exc()
-        log_error(summary + details)
+        try:
+            interval = self.mail_spool.send()
+        except Exception:
+            # Keep the sender scheduled, try again later
+            log_error('Spool error\n' + format_exc())
+            self.mail_spool.close()
+            return self.mail_spool.backoff_min
+        if interval is False:
+            self.spool_scheduled = False
+        return interval
 
 
     def register_ui_router(self):
@@ -735,8 +990,63 @@ class Server(WebServer):
     #######################################################################
     # Time events
     #######################################################################
+    cron_generation = 0
+    cron_running = False
+    cron_wakeup = None
+    # The events that ran but whose changes could not be saved
+    cron_ran = frozenset()
+
+
+    def schedule_cron(self, delay):
+        """Runs the cron manager in 'delay' seconds, unless it is already
+        scheduled to run sooner.
+        """
+        delay = max(int(delay), 1)
+        wakeup = time() + delay
+        if self.cron_wakeup is not None and self.cron_wakeup <= wakeup:
+            return
+        self.cron_wakeup = wakeup
+        # The timers scheduled before are obsolete
+        self.cron_generation += 1
+        cron(self._cron_tick, delay, self.cron_generation)
+
+
+    def _cron_tick(self, generation):
+        if generation != self.cron_generation:
+            return False
+
+        self.cron_wakeup = None
+        try:
+            delay = self.cron_manager()
+        except Exception:
+            log_error('Cron error\n' + format_exc())
+            delay = self.config.get_value('cron-interval')
+        self.schedule_cron(delay)
+        return False
+
+
+    def cron_on_commit(self, database, paths):
+        """Wakes up the cron manager sooner if a resource changed has an
+        earlier time event.
+        """
+        if self.cron_running:
+            return
+
+        paths = list(paths)
+        for n in range(0, len(paths), 200):
+            query = [ PhraseQuery('abspath', x) for x in paths[n:n+200] ]
+            for brain in database.search(OrQuery(*query)).get_documents():
+                if brain.next_time_event is not None:
+                    self.schedule_cron(get_delay(brain.next_time_event))
+
+
     def cron_manager(self):
+        """Runs the time events due, returns the number of seconds until the
+        next one (or 'cron-interval' if it is sooner).
+        """
         database = self.database
+        interval = self.config.get_value('cron-interval')
+        batch_size = self.config.get_value('cron-batch-size')
 
         # Build fake context
         context = get_fake_context(database, self.root.context_cls)
@@ -745,27 +1055,152 @@ class Server(WebServer):
         context.is_cron = True
 
         # Go
-        query = RangeQuery('next_time_event', None, context.timestamp)
-        for brain in database.search(query).get_documents():
-            payload = pickle.loads(brain.next_time_event_payload)
-            resource = database.get_resource(brain.abspath)
+        self.cron_running = True
+        ran = set(self.cron_ran)
+        try:
+            query = RangeQuery('next_time_event', None, context.timestamp)
+            search = database.search(query)
+            events = [
+                (brain.abspath, brain.next_time_event_payload)
+                for brain in search.get_documents(sort_by='next_time_event') ]
+            # The events that ran but whose changes could not be saved are
+            # not run again, their side effects (e.g. emails) are done
+            ran.intersection_update(events)
+            events = [ x for x in events if x not in ran ]
+            for n in range(0, len(events), batch_size):
+                batch = events[n:n+batch_size]
+                try:
+                    self.run_time_events(context, batch, ran)
+                except Exception:
+                    log_error('Cron error\n' + format_exc())
+                    self.abort_time_events()
+                    # Try again every event alone, but those that ran
+                    for event in batch:
+                        if event in ran:
+                            msg = 'Cron: the changes of "%s" are lost'
+                            log_warning(msg % event[0], domain='ikaaro')
+                            continue
+                        try:
+                            self.run_time_events(context, [event], ran)
+                        except Exception:
+                            log_error('Cron error\n' + format_exc())
+                            self.abort_time_events()
+                        else:
+                            ran.discard(event)
+                else:
+                    ran.difference_update(batch)
+        finally:
+            self.cron_ran = ran
+            self.cron_running = False
+
+        # Again, and again
+        query = RangeQuery('next_time_event', context.timestamp, None)
+        search = database.search(query)
+        brains = search.get_documents(sort_by='next_time_event', size=1)
+        if not brains:
+            return interval
+        return min(get_delay(brains[0].next_time_event), interval)
+
+
+    def run_time_events(self, context, events, ran):
+        """Runs the given time events, the list of tuples (abspath, payload),
+        and saves the changes in one transaction.  The events run are added
+        to the set 'ran'.
+        """
+        database = self.database
+        resources = []
+        for event in events:
+            abspath, payload = event
+            resource = database.get_resource(abspath, soft=True)
+            if resource is None:
+                continue
+            ran.add(event)
             try:
-                resource.time_event(payload)
+                resource.time_event(pickle.loads(payload))
             except Exception:
                 # Log error
                 log_error('Cron error\n' + format_exc())
                 context.root.alert_on_internal_server_error(context)
-            # Reindex resource without committing
-            catalog = database.catalog
-            catalog.unindex_document(str(resource.abspath))
-            catalog.index_document(resource.get_catalog_values())
-            catalog.save_changes()
+            resources.append(resource)
+
+        # Reindex the resources not changed, to update their next time
+        # event (the changed ones are reindexed by the commit)
+        catalog = database.catalog
+        changed = database.resources_new2old
+        for resource in resources:
+            abspath = str(resource.abspath)
+            if abspath not in changed:
+                catalog.unindex_document(abspath)
+                catalog.index_document(resource.get_catalog_values())
 
         # Save changes
-        database.save_changes()
+        if database.has_changed:
+            database.save_changes()
+        else:
+            catalog.save_changes()
 
-        # Again, and again
-        return self.config.get_value('cron-interval')
+
+    def abort_time_events(self):
+        database = self.database
+        database.abort_changes()
+        database.catalog.abort_changes()
+
+
+
+def get_delay(date):
+    """Returns the number of seconds from now to the given date (negative
+    if the date is past).
+    """
+    now = datetime.utcnow().replace(tzinfo=fixed_offset(0))
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=now.tzinfo)
+    delta = date - now
+    return delta.days * 86400 + delta.seconds
+
+
+
+def reindex_worker(server, tasks, results):
+    """Worker process of the parallel catalog rebuild: computes the catalog
+    values of the subtrees taken from the 'tasks' queue and puts them, as
+    tuples (abspath, values, error), into the 'results' queue.
+    """
+    size_min, size_max = server.database_size
+    database = get_database(server.target, size_min, size_max, True)
+    root = database.get_resource('/')
+    context = get_fake_context(database, root.context_cls)
+    context.server = server
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+
+            path, recursive = task
+            try:
+                resource = database.get_resource(path)
+                if recursive:
+                    resources = resource.traverse_resources()
+                else:
+                    resources = [resource]
+                for obj in resources:
+                    if not isinstance(obj, Resource):
+                        continue
+                    abspath = str(obj.abspath)
+                    context.resource = obj
+                    try:
+                        values = obj.get_catalog_values()
+                    except Exception:
+                        results.put((abspath, None, format_exc()))
+                    else:
+                        results.put((abspath, values, None))
+                    # Free Memory
+                    del obj
+                    database.make_room()
+            except Exception:
+                results.put((path, None, format_exc()))
+    finally:
+        results.put(None)
 
 
 
@@ -780,11 +1215,13 @@ class ServerConfig(ConfigFile):
         'smtp-from': String(default=''),
         'smtp-login': String(default=''),
         'smtp-password': String(default=''),
+        'smtp-batch-size': Integer(default=50),
         # Logging
         'log-level': String(default='warning'),
         'log-email': Email(default=''),
         # Time events
         'cron-interval': Integer(default=0),
+        'cron-batch-size': Integer(default=100),
         # Security
         'session-timeout': ExpireValue(default=timedelta(0)),
         # Tuning
@@ -793,6 +1230,10 @@ class ServerConfig(ConfigFile):
         'index-text': Boolean(default=True),
         'max-width': Integer(default=None),
         'max-height': Integer(default=None),
+        'thumbnails-size': Integer(default=100),
+        'output-cache-size': Integer(default=0),
+        'output-cache-ttl': Integer(default=300),
+        'output-cache-disk-size': Integer(default=0),
     }
 
 
@@ -31,11 +31,42 @@ from itools.web import get_context, ERROR, INFO
 
 # Import from ikaaro
 from context import register_ui
+from database import register_commit_hook
 from folder import Folder
 from views import get_view_scripts
 from skins_views import LanguagesTemplate, LocationTemplate
 
 
+class SkinCache(object):
+    """Cache of the parts of the skin namespace that are the same for every
+    page: the theme files, the search engine meta tags and the footer.
+    Everything is dropped when a resource within '/config' changes.
+    """
+
+    def __init__(self):
+        self.values = {}
+
+
+    def get(self, key):
+        return self.values.get(key)
+
+
+    def set(self, key, value):
+        self.values[key] = value
+
+
+    def on_commit(self, database, paths):
+        for path in paths:
+            if path == '/config' or path.startswith('/config/'):
+                self.values.clear()
+                return
+
+
+skin_cache = SkinCache()
+register_commit_hook(skin_cache.on_commit)
+
+
+
 class Skin(object):
 
     class_title = MSG(u'Skin')
@@ -89,6 +120,25 @@ class Skin(object):
         return None
 
 
+    def get_theme_files(self, context):
+        """Returns the dict {name: mimetype} of the files of the theme (the
+        style, the logo and the favicon) the user is allowed to see.
+        """
+        root = context.root
+        access = root.get_resource('config/access')
+        user_groups, is_admin = access._get_user_groups(context.user)
+        key = ('theme', frozenset(user_groups))
+        files = skin_cache.get(key)
+        if files is None:
+            files = {}
+            for name in ['style', 'logo', 'favicon']:
+                value = self._get_theme_file(context, name)
+                if value:
+                    files[name] = value.get_mimetype()
+            skin_cache.set(key, files)
+        return files
+
+
     def get_styles(self, context):
         # Generic
         styles = ['/ui/bo.css']
@@ -106,7 +156,7 @@ class Skin(object):
         styles.extend(extra)
 
         # Database style
-        if self._get_theme_file(context, 'style'):
+        if 'style' in self.get_theme_files(context):
             styles.append(
                 '/config/theme/;get_file?name=style&mimetype=text/css')
 
@@ -166,7 +216,24 @@ class Skin(object):
                              'content': value})
 
         # Search engine optimization
-        seo = root.get_resource('config/seo')
+        meta.extend(self.get_seo_meta_tags(context))
+
+        # View
+        # meta are defined as a tuple (name, content, language)
+        extra_meta = getattr(context.view, 'meta', [])
+        for (name, content, lang) in extra_meta:
+            meta.append({'name': name, 'content': content, 'lang': lang})
+
+        return meta
+
+
+    def get_seo_meta_tags(self, context):
+        meta = skin_cache.get('seo')
+        if meta is not None:
+            return meta
+
+        meta = []
+        seo = context.root.get_resource('config/seo')
         for key, meta_name in [
             ('google_site_verification', 'google-site-verification'),
             ('yahoo_site_verification', 'y_key'),
@@ -176,22 +243,15 @@ class Skin(object):
                 meta.append({'name': meta_name,
                              'lang': None,
                              'content': verification_key})
-
-        # View
-        # meta are defined as a tuple (name, content, language)
-        extra_meta = getattr(context.view, 'meta', [])
-        for (name, content, lang) in extra_meta:
-            meta.append({'name': name, 'content': content, 'lang': lang})
-
+        skin_cache.set('seo', meta)
         return meta
 
 
     def get_favicon(self, context):
         # Case 1: from the database
-        favicon = self._get_theme_file(context, 'favicon')
-        if favicon:
+        favicon_type = self.get_theme_files(context).get('favicon')
+        if favicon_type:
             favicon_href = '/config/theme/;get_file?name=favicon'
-            favicon_type = favicon.get_mimetype()
             return favicon_href, favicon_type
 
         # Case 2: from the skin
@@ -325,8 +385,16 @@ class Skin(object):
 
 
     def get_footer(self, context):
-        footer = context.root.get_resource('config/footer')
-        return footer.get_html_data()
+        root = context.root
+        languages = root.get_value('website_languages')
+        language = context.accept_language.select_language(languages)
+        key = ('footer', language)
+        footer = skin_cache.get(key)
+        if footer is None:
+            footer = root.get_resource('config/footer')
+            footer = list(footer.get_html_data())
+            skin_cache.set(key, footer)
+        return footer
 
 
     def get_menu_namespace(self, context):
@@ -346,7 +414,7 @@ class Skin(object):
         favicon_href, favicon_type = self.get_favicon(context)
 
         # Logo
-        logo = self._get_theme_file(context, 'logo')
+        logo = 'logo' in self.get_theme_files(context)
         logo_href = '/config/theme/;get_file?name=logo' if logo else None
 
         # The document language
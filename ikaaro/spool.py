@@ -0,0 +1,300 @@
+# -*- coding: UTF-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from email.parser import HeaderParser
+from email.utils import getaddresses
+from os import fdopen, listdir, makedirs, remove, rename
+from os.path import exists, join
+from smtplib import SMTP, SMTPRecipientsRefused, SMTPResponseException
+from smtplib import SMTPServerDisconnected
+from tempfile import mkstemp
+from time import time
+from traceback import format_exc
+
+# Import from itools
+from itools.log import log_error, log_info, log_warning
+
+
+
+def remove_header(message, name):
+    """Returns the message without the given header.
+    """
+    header, sep, body = message.partition('\n\n')
+    name = '%s:' % name.lower()
+    lines = []
+    skip = False
+    for line in header.split('\n'):
+        # Continuation lines
+        if line[:1] not in (' ', '\t'):
+            skip = line.lower().startswith(name)
+        if not skip:
+            lines.append(line)
+    return '\n'.join(lines) + sep + body
+
+
+
+class MailSpool(object):
+    """The emails to send are files in the spool folder.  The sender claims
+    a file renaming it to '<name>.lock', and sends the emails in batches
+    through one SMTP connection, kept open while there are emails to send.
+
+    When the SMTP server answers with a temporary error for a destination
+    domain, the emails to that domain are tried again later, the delay
+    doubling every time.
+
+    The emails sent to many recipients (see 'Root.send_bulk_email') carry
+    the addresses in the "Bcc" header, which is removed before sending.
+    """
+
+    # Delays, in seconds
+    backoff_min = 60
+    backoff_max = 3600
+
+
+    def __init__(self, path, smtp_host, smtp_login=None, smtp_password=None,
+                 batch_size=50):
+        self.path = path
+        self.smtp_host = smtp_host
+        self.smtp_login = smtp_login
+        self.smtp_password = smtp_password
+        self.batch_size = batch_size
+        self.smtp = None
+        # The destinations to try later {domain: (time, delay)}
+        self.backoff = {}
+        # Metrics
+        self.sent = 0
+        self.failed = 0
+        self.deferred = 0
+        self.rate = 0.0
+
+        failed = join(path, 'failed')
+        if not exists(failed):
+            makedirs(failed)
+
+
+    def release_locks(self):
+        """Releases the emails claimed by a sender that did not finish.  To
+        be called when the server starts, before sending.
+        """
+        path = self.path
+        for name in listdir(path):
+            if name[-5:] == '.lock':
+                rename(join(path, name), join(path, name[:-5]))
+
+
+    def get_names(self):
+        """Returns the names of the emails waiting to be sent.
+        """
+        names = []
+        for name in listdir(self.path):
+            if name == 'failed' or name.endswith(('.lock', '.tmp')):
+                continue
+            names.append(name)
+        return names
+
+
+    def get_size(self):
+        return len(self.get_names())
+
+
+    def get_stats(self):
+        return {'spool': self.get_size(), 'sent': self.sent,
+                'failed': self.failed, 'deferred': self.deferred,
+                'rate': self.rate}
+
+
+    def save(self, data):
+        """Adds an email to the spool, the email is visible to the sender
+        once it is completely written.
+        """
+        fd, tmp_path = mkstemp(suffix='.tmp', dir=self.path)
+        file = fdopen(fd, 'w')
+        try:
+            file.write(data)
+        finally:
+            file.close()
+        rename(tmp_path, tmp_path[:-4])
+
+
+    #######################################################################
+    # SMTP
+    #######################################################################
+    def connect(self):
+        if self.smtp is None:
+            smtp = SMTP(self.smtp_host)
+            if self.smtp_login and self.smtp_password:
+                smtp.login(self.smtp_login, self.smtp_password)
+            log_info('CONNECTED to %s' % self.smtp_host)
+            self.smtp = smtp
+        return self.smtp
+
+
+    def close(self):
+        smtp, self.smtp = self.smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except Exception:
+                pass
+
+
+    def sendmail(self, from_addr, to_addr, message):
+        """Sends the message, returns the dict of the refused recipients.
+        """
+        try:
+            return self.connect().sendmail(from_addr, to_addr, message)
+        except SMTPServerDisconnected:
+            # The server closed the connection, open a new one
+            self.close()
+            return self.connect().sendmail(from_addr, to_addr, message)
+
+
+    #######################################################################
+    # Back off
+    #######################################################################
+    def get_domain(self, to_addr):
+        for name, address in getaddresses([to_addr or '']):
+            if '@' in address:
+                return address.rsplit('@', 1)[1].lower()
+        return None
+
+
+    def is_deferred(self, domain, now):
+        backoff = self.backoff.get(domain)
+        return backoff is not None and backoff[0] > now
+
+
+    def defer(self, domain, now):
+        backoff = self.backoff.get(domain)
+        if backoff is None:
+            delay = self.backoff_min
+        else:
+            delay = min(backoff[1] * 2, self.backoff_max)
+        self.backoff[domain] = (now + delay, delay)
+
+
+    #######################################################################
+    # Send
+    #######################################################################
+    def send(self):
+        """Sends a batch of emails.  Returns the number of seconds to wait
+        before the next batch, or False if there is nothing left to send.
+        """
+        t0 = time()
+        path = self.path
+        n = 0
+        left = False
+        for name in sorted(self.get_names()):
+            if n >= self.batch_size:
+                left = True
+                break
+
+            # Claim the email
+            src = join(path, name)
+            lock = '%s.lock' % src
+            try:
+                rename(src, lock)
+            except OSError:
+                continue
+
+            # Read the headers
+            with open(lock) as file:
+                message = file.read()
+            header = message.split('\n\n', 1)[0]
+            headers = HeaderParser().parsestr(header, headersonly=True)
+            subject = headers['subject']
+            from_addr = headers['from']
+            to_addr = headers['to']
+            bcc = headers['bcc']
+            if bcc:
+                # Bulk email
+                to_addr = [ addr for real, addr in getaddresses([bcc])
+                            if addr ]
+                message = remove_header(message, 'bcc')
+                domain = self.get_domain(bcc)
+            else:
+                domain = self.get_domain(to_addr)
+            if self.is_deferred(domain, t0):
+                rename(lock, src)
+                continue
+
+            # Connect
+            try:
+                self.connect()
+            except Exception:
+                self.log_error()
+                self.close()
+                rename(lock, src)
+                return self.backoff_min
+
+            # Send
+            n += 1
+            try:
+                refused = self.sendmail(from_addr, to_addr, message)
+            except SMTPRecipientsRefused:
+                # The recipient addresses has been refused
+                self.log_error()
+                rename(lock, join(path, 'failed', name))
+                self.failed += 1
+            except SMTPResponseException, excp:
+                self.log_error()
+                if 400 <= excp.smtp_code < 500:
+                    # Temporary error, try again later
+                    self.defer(domain, t0)
+                    rename(lock, src)
+                    self.deferred += 1
+                else:
+                    name = '%s_%s' % (excp.smtp_code, name)
+                    rename(lock, join(path, 'failed', name))
+                    self.failed += 1
+            except Exception:
+                # Connection lost, try again later
+                self.log_error()
+                self.close()
+                rename(lock, src)
+                return self.backoff_min
+            else:
+                remove(lock)
+                self.sent += 1
+                self.backoff.pop(domain, None)
+                if type(to_addr) is list:
+                    to_addr = '%d recipients' % len(to_addr)
+                log_msg = 'Email "%s" sent from "%s" to "%s"'
+                log_info(log_msg % (subject, from_addr, to_addr))
+                if refused:
+                    log_msg = 'Email "%s" refused for: %s'
+                    log_warning(log_msg % (subject, ', '.join(refused)))
+
+        # Metrics
+        t1 = time()
+        if n:
+            self.rate = n / max(t1 - t0, 0.001)
+
+        # Is there something left?
+        if left:
+            return 1
+        self.close()
+        if not self.get_names():
+            return False
+        # Only deferred emails, wake up when the first delay expires
+        now = time()
+        times = [ x for x, delay in self.backoff.values() if x > now ]
+        return max(1, int(min(times or [now + self.backoff_min]) - now))
+
+
+    def log_error(self):
+        summary = 'Error sending email\n'
+        details = format_exc()
+        log_error(summary + details)
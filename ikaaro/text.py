@@ -36,6 +36,7 @@ from autoform import MultilineWidget
 from database import Database
 from file import File
 from file_views import File_Edit
+from links import get_cached_references
 from text_views import Text_Edit, Text_View, PO_Edit
 from text_views import CSV_View, CSV_AddRow, CSV_EditRow
 from text_views import CSS_Edit
@@ -56,6 +57,32 @@ def css_get_reference(uri):
     return get_reference(value)
 
 
+def get_css_references(handler):
+    """Returns the paths referenced by the given CSS handler, but external
+    links and links to '/ui/'.
+    """
+    references = []
+    data = handler.to_text().encode('utf-8')
+    for segment in css_uri_expr.findall(data):
+        reference = css_get_reference(segment)
+
+        # Skip empty links, external links and links to '/ui/'
+        if reference.scheme or reference.authority:
+            continue
+        path = reference.path
+        if not path or path[0] == 'ui':
+            continue
+
+        # Strip the view
+        name = path.get_name()
+        if name and name[0] == ';':
+            path = path[:-1]
+
+        references.append(path)
+
+    return references
+
+
 
 class Text(File):
 
@@ -106,36 +133,22 @@ class CSS(Text):
 
     def get_links(self):
         links = super(CSS, self).get_links()
-        base = self.abspath
-        data = self.to_text().encode('utf-8')
-
-        segments = css_uri_expr.findall(data)
-        for segment in segments:
-            reference = css_get_reference(segment)
-
-            # Skip empty links, external links and links to '/ui/'
-            if reference.scheme or reference.authority:
-                continue
-            path = reference.path
-            if not path or path[0] == 'ui':
-                continue
-
-            # Strip the view
-            name = path.get_name()
-            if name and name[0] == ';':
-                path = path[:-1]
+        handler = self.get_value('data')
+        if not handler:
+            return links
 
+        base = self.abspath
+        for path in get_cached_references(handler, get_css_references):
             # Absolute path are relative to site root
             if not path.is_absolute():
-                uri = base.resolve2(path)
-
-            links.add(str(uri))
+                path = base.resolve2(path)
+            links.add(str(path))
 
         return links
 
 
-    def update_links(self,  source, target):
-        super(CSS, self).update_links(source, target)
+    def update_links_map(self, links_map):
+        super(CSS, self).update_links_map(links_map)
         resources_new2old = get_context().database.resources_new2old
         base = str(self.abspath)
         old_base = resources_new2old.get(base, base)
@@ -167,7 +180,8 @@ class CSS(Text):
                 path = old_base.resolve2(path)
 
             # Match ?
-            if path == source:
+            target = links_map.get(str(path))
+            if target is not None:
                 path = str(new_base.get_pathto(target)) + view
                 new_path = Reference('', '', path, reference.query.copy(),
                                      reference.fragment)
@@ -0,0 +1,147 @@
+# -*- coding: UTF-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from hashlib import sha1
+from os import makedirs, remove, rename, stat, utime, walk
+from os.path import dirname, exists, getsize, join
+
+# Import from itools
+from itools.log import log_warning
+from itools.web import get_context
+
+# Import from ikaaro
+from utils import get_handler_blob_id
+
+
+
+class ThumbnailStore(object):
+    """Content addressed store of the thumbnails, kept on disk so they
+    survive the database cache and restarts.  A thumbnail is identified by
+    the blob id of the image and by the parameters it was made with.
+
+    The store is bounded: when its size goes over 'size_max' bytes, the
+    least recently used thumbnails are removed.
+    """
+
+    def __init__(self, path, size_max):
+        self.path = path
+        self.size_max = size_max
+        if not exists(path):
+            makedirs(path)
+        # Current size of the store
+        self.size = 0
+        for name, info in self._get_files():
+            self.size += info.st_size
+
+
+    def _get_files(self):
+        for folder, folders, files in walk(self.path):
+            for name in files:
+                name = join(folder, name)
+                try:
+                    yield name, stat(name)
+                except OSError:
+                    pass
+
+
+    def get_path(self, blob_id, width, height, format, fit):
+        key = '%s:%s:%s:%s:%s' % (blob_id, width, height, format, fit)
+        key = sha1(key).hexdigest()
+        return join(self.path, key[:2], key[2:])
+
+
+    def get(self, blob_id, width, height, format, fit):
+        """Returns the tuple (data, format) of the thumbnail, or None if it
+        is not in the store.
+        """
+        path = self.get_path(blob_id, width, height, format, fit)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            # Mark the thumbnail as recently used
+            utime(path, None)
+        except (IOError, OSError):
+            return None
+
+        format, data = data.split('\n', 1)
+        return data, format
+
+
+    def set(self, blob_id, width, height, format, fit, thumbnail):
+        """Stores the thumbnail, the tuple (data, format) returned by the
+        'get_thumbnail' method of the image handler.
+        """
+        data, thumb_format = thumbnail
+        data = '%s\n%s' % (thumb_format, data)
+
+        path = self.get_path(blob_id, width, height, format, fit)
+        folder = dirname(path)
+        try:
+            if not exists(folder):
+                makedirs(folder)
+            # The file may be overwritten
+            if exists(path):
+                self.size -= getsize(path)
+            # Atomic write
+            tmp_path = '%s.tmp' % path
+            with open(tmp_path, 'wb') as file:
+                file.write(data)
+            rename(tmp_path, path)
+        except (IOError, OSError):
+            log_warning('thumbnail store: could not write %s' % path,
+                        domain='ikaaro')
+            return
+
+        self.size += len(data)
+        if self.size > self.size_max:
+            self.evict()
+
+
+    def evict(self):
+        """Removes the least recently used thumbnails, until the size of
+        the store is 90% of its limit.
+        """
+        files = sorted(self._get_files(), key=lambda x: x[1].st_mtime)
+        size = sum([ info.st_size for name, info in files ])
+        limit = self.size_max * 0.9
+        for name, info in files:
+            if size <= limit:
+                break
+            try:
+                remove(name)
+            except OSError:
+                continue
+            size -= info.st_size
+        self.size = size
+
+
+
+
+def get_thumbnail(handler, width, height, format='jpeg', fit=False):
+    """Same as the 'get_thumbnail' method of the image handler, but the
+    thumbnails are kept in the store of the server (if any).
+    """
+    server = get_context().server
+    store = server.thumbnails if server is not None else None
+    if store is None:
+        return handler.get_thumbnail(width, height, format, fit)
+
+    blob_id = get_handler_blob_id(handler)
+    thumbnail = store.get(blob_id, width, height, format, fit)
+    if thumbnail is None:
+        thumbnail = handler.get_thumbnail(width, height, format, fit)
+        if thumbnail[0] is not None:
+            store.set(blob_id, width, height, format, fit, thumbnail)
+    return thumbnail
@@ -103,9 +103,9 @@ class User(DBResource):
     email = UserEmail_Field
     password = Password_Field(multiple=True)
     avatar = File_Field(title=MSG(u'Avatar'))
-    user_language = Char_Field
+    user_language = Char_Field(indexed=True, stored=True)
     user_timezone = Char_Field
-    user_state = UserState_Field
+    user_state = UserState_Field(indexed=True, stored=True)
     groups = UserGroups_Field
     username = Char_Field(indexed=True, stored=True) # Backwards compatibility
 
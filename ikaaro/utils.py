@@ -18,6 +18,8 @@
 
 # Import from the Standard Library
 from hashlib import sha1, sha256
+from os import stat
+from os.path import join
 from random import sample
 
 # Import from other modules
@@ -27,13 +29,14 @@ except ImportError:
     tidy = None
 
 # Import from itools
+from itools.core import LRUCache
 from itools.database import AllQuery, AndQuery, PhraseQuery, OrQuery
 from itools.database import RangeQuery
 from itools.datatypes import Unicode
 from itools.handlers import checkid
 from itools.html import HTMLParser, stream_to_str_as_xhtml
 from itools.stl import STLTemplate, stl_namespaces
-from itools.uri import get_reference, Reference
+from itools.uri import get_reference, Path, Reference
 from itools.web import get_context
 from itools.xml import XMLParser
 
@@ -209,6 +212,117 @@ def get_secure_hash(password, algo, salt=None):
 
 
 
+###########################################################################
+# Git
+###########################################################################
+def get_git_blob_id(data):
+    """Returns the identifier git gives to a blob with the given contents.
+    """
+    return sha1('blob %d\0%s' % (len(data), data)).hexdigest()
+
+
+def get_git_file_blob_id(path, chunk_size=65536):
+    """Same as 'get_git_blob_id', but reads the contents from the given file
+    by chunks, so it is never loaded in memory at once.
+    """
+    with open(path, 'rb') as file:
+        file.seek(0, 2)
+        blob_id = sha1('blob %d\0' % file.tell())
+        file.seek(0)
+        data = file.read(chunk_size)
+        while data:
+            blob_id.update(data)
+            data = file.read(chunk_size)
+    return blob_id.hexdigest()
+
+
+def get_handler_path(handler):
+    """Returns the absolute path of the file of the given handler, or None
+    if it has no file.  The keys of the handlers of the database are
+    relative to its 'database' folder.
+    """
+    key = handler.key
+    if key is None:
+        return None
+    path_data = getattr(handler.database, 'path_data', None)
+    if path_data is None:
+        return key
+    return join(path_data, key)
+
+
+# Blob ids of the files, by (path, mtime, size)
+blob_ids = LRUCache(500, 1000)
+
+def get_file_blob_id(path):
+    """Returns the git blob id of the file at the given path, cached while
+    its mtime and size do not change, or None if there is no such file.
+    """
+    try:
+        info = stat(path)
+    except (OSError, TypeError):
+        return None
+
+    key = (path, info.st_mtime, info.st_size)
+    blob_id = blob_ids.get(key)
+    if blob_id is None:
+        blob_id = get_git_file_blob_id(path)
+        blob_ids[key] = blob_id
+    return blob_id
+
+
+def get_handler_blob_id(handler):
+    """Returns the git blob id of the given file handler.  It is computed
+    from the file, and cached, unless the handler has been modified in the
+    current transaction.
+    """
+    if not handler.dirty:
+        blob_id = get_file_blob_id(get_handler_path(handler))
+        if blob_id is not None:
+            return blob_id
+    return get_git_blob_id(handler.to_str())
+
+
+
+###########################################################################
+# HTTP
+###########################################################################
+def parse_http_range(value, size):
+    """Parses the value of the HTTP 'Range' header for an entity of the
+    given size, returns the first and last positions (included) of the
+    range.  Returns None if the header is not a single byte range we can
+    satisfy partially, raises ValueError if the range is not satisfiable.
+    """
+    value = value.strip()
+    if not value.startswith('bytes='):
+        return None
+    value = value[6:]
+    # Multiple ranges are not supported, the entity is sent entirely
+    if ',' in value:
+        return None
+
+    first, sep, last = value.partition('-')
+    first = first.strip()
+    last = last.strip()
+    if not sep or not (first + last).isdigit():
+        return None
+
+    if first:
+        first = int(first)
+        if first >= size:
+            raise ValueError, 'range not satisfiable'
+        last = int(last) if last else size - 1
+        if last < first:
+            return None
+        return first, min(last, size - 1)
+
+    # Suffix range: the last n bytes
+    last = int(last)
+    if last == 0 or size == 0:
+        raise ValueError, 'range not satisfiable'
+    return max(size - last, 0), size - 1
+
+
+
 ###########################################################################
 # Generate next name
 ###########################################################################
@@ -249,6 +363,94 @@ def generate_name(name, used, suffix='_'):
 
 
 
+###########################################################################
+# Order
+###########################################################################
+# The ranks are strings sorted in lexicographic order, made of these digits
+RANK_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+def _encode_rank(n, width):
+    base = len(RANK_DIGITS)
+    rank = ''
+    for i in range(width):
+        n, digit = divmod(n, base)
+        rank = RANK_DIGITS[digit] + rank
+    return rank
+
+
+def get_rank_after(rank=None):
+    """Returns a rank that sorts after the given one.  The ranks of one
+    digit go up to 'y', then come the ranks made of 'z' and two digits,
+    then 'zz' and three digits, etc.  So appending n times makes ranks of
+    length O(log n).
+    """
+    digits = RANK_DIGITS
+    base = len(digits)
+    if not rank:
+        return digits[base // 2]
+
+    # The number of 'z' (k), then the next k + 1 digits are incremented
+    last = digits[-1]
+    k = len(rank) - len(rank.lstrip(last))
+    n = 0
+    for digit in rank[k:2 * k + 1].ljust(k + 1, digits[0]):
+        n = n * base + digits.index(digit)
+    n += 1
+    if n < (base - 1) * base ** k:
+        return last * k + _encode_rank(n, k + 1)
+    # Next length
+    return last * (k + 1) + _encode_rank(1, k + 2)
+
+
+def get_rank_between(before=None, after=None):
+    """Returns a rank that sorts after the 'before' rank and before the
+    'after' rank, where None means no bound.  Without upper bound the
+    rank is incremented instead of halved, see 'get_rank_after'.
+    """
+    if before and after and before >= after:
+        raise ValueError, 'expected %r to be smaller than %r' % (before,
+                                                                 after)
+
+    digits = RANK_DIGITS
+    before = before or ''
+    rank = ''
+    i = 0
+    while after is not None:
+        if i >= len(after):
+            # Only zeros are left in 'after'
+            raise ValueError, 'no rank between %r and %r' % (before, after)
+        a = digits.index(before[i]) if i < len(before) else 0
+        b = digits.index(after[i])
+        # Common prefix
+        if a == b:
+            rank += digits[a]
+            i += 1
+            continue
+        # Room for a digit in between
+        if b - a > 1:
+            return rank + digits[(a + b) // 2]
+        # Take the digit of 'before', from now on there is no upper bound
+        rank += digits[a]
+        after = None
+        i += 1
+
+    return rank + get_rank_after(before[i:])
+
+
+def get_ranks(n):
+    """Returns n ranks of the same length, evenly spread and sorted, so
+    there is room to insert ranks between them.
+    """
+    base = len(RANK_DIGITS)
+    width = 1
+    while base ** width <= n:
+        width += 1
+
+    size = base ** width
+    return [ _encode_rank(i * size // (n + 1), width)
+             for i in range(1, n + 1) ]
+
+
 ###########################################################################
 # Index and Search
 ###########################################################################
@@ -291,27 +493,82 @@ def get_base_path_query(path, min_depth=1, max_depth=None):
     return query
 
 
+def get_links_query(*paths):
+    """Builds a query that will return the resources linking to any of the
+    given absolute paths.
+    """
+    query = [ PhraseQuery('links', str(x)) for x in paths ]
+    if len(query) == 1:
+        return query[0]
+    return OrQuery(*query)
+
+
+
+class PathTrie(object):
+    """Maps absolute paths to values, and finds efficiently the values
+    attached to a path or to any of its ancestors.
+    """
+
+    def __init__(self):
+        self.root = ({}, [])
+
+
+    def add(self, path, value):
+        if type(path) is not Path:
+            path = Path(path)
+
+        node = self.root
+        for name in path:
+            node = node[0].setdefault(name, ({}, []))
+        node[1].append(value)
+
+
+    def get_matches(self, path):
+        """Yields a tuple (distance, value) for every value attached to the
+        given path or to one of its ancestors, where distance is the
+        number of levels between them (0 for the path itself).
+        """
+        if type(path) is not Path:
+            path = Path(path)
+
+        node = self.root
+        n = len(path)
+        i = 0
+        while True:
+            for value in node[1]:
+                yield n - i, value
+            if i == n:
+                return
+            node = node[0].get(path[i])
+            if node is None:
+                return
+            i += 1
+
+
+
 ###########################################################################
 # Used by the add-form
 ###########################################################################
-def get_content_containers(context, class_id=None):
+def get_content_containers_query(context, class_id=None):
+    """Returns the query of the folders where the user is allowed to add
+    resources of the given class (any class if None).  It is to be used
+    with 'context.search', which checks the 'view' permission.
+    """
     query = AndQuery(
         PhraseQuery('base_classes', 'folder'),
         PhraseQuery('is_content', True))
+    if class_id is not None:
+        query.append(PhraseQuery('document_types', class_id))
 
-    root = context.root
-    for container in context.search(query).get_resources():
-        if not root.has_permission(context.user, 'add', container, class_id):
-            continue
+    # The 'add' access rules
+    access = context.root.get_resource('config/access')
+    query.append(access.get_search_query(context.user, 'add', class_id))
+    return query
 
-        if class_id is None:
-            yield container
-            continue
 
-        for cls in container.get_document_types():
-            if class_id == cls.class_id:
-                yield container
-                break
+def get_content_containers(context, class_id=None):
+    query = get_content_containers_query(context, class_id)
+    return context.search(query).get_resources()
 
 
 ###########################################################################
@@ -35,11 +35,23 @@ def update_catalog(parser, options, target):
     if ask_confirmation(message, options.confirm) is False:
         return
 
+    # Only the documents that are not up-to-date
+    if options.incremental:
+        server.reindex_stale_documents(quiet=options.quiet)
+        return
+
     # Server reindex
+    max_memory = options.max_memory
+    if max_memory is not None:
+        max_memory = max_memory * 1024 * 1024
     server.reindex_catalog(
         as_test=options.test,
         quiet=options.quiet,
-        quick=options.quick)
+        quick=options.quick,
+        jobs=options.jobs,
+        resume=options.resume,
+        checkpoint=options.checkpoint,
+        max_memory=max_memory)
 
 
 
@@ -65,6 +77,21 @@ if __name__ == '__main__':
         help="do not check the database consistency.")
     parser.add_option('-t', '--test', action='store_true', default=False,
         help="a test mode, don't stop the indexation when an error occurs")
+    parser.add_option('-i', '--incremental', action='store_true',
+        default=False,
+        help="only reindex the documents that are missing or not up-to-date,"
+             " and remove the documents of resources that do not exist")
+    parser.add_option('-j', '--jobs', type='int', default=1,
+        help="compute the catalog values with the given number of worker"
+             " processes (default 1)")
+    parser.add_option('--checkpoint', type='int', default=10000,
+        help="commit the new catalog every given number of documents, so"
+             " the update can be resumed (default 10000, 0 to disable)")
+    parser.add_option('--resume', action='store_true', default=False,
+        help="resume an interrupted update from its last checkpoint")
+    parser.add_option('--max-memory', type='int', default=None,
+        help="only free the database cache when the process uses more than"
+             " the given amount of memory, in megabytes")
 
     options, args = parser.parse_args()
     if len(args) != 1:
@@ -18,10 +18,16 @@
 from unittest import TestLoader, TestSuite, TextTestRunner
 
 # Import tests
+import test_database
 import test_metadata
+import test_output_cache
+import test_spool
+import test_thumbnails
+import test_utils
 
 
-test_modules = [test_metadata]
+test_modules = [test_database, test_metadata, test_output_cache, test_spool,
+                test_thumbnails, test_utils]
 
 
 loader = TestLoader()
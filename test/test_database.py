@@ -0,0 +1,98 @@
+# -*- coding: UTF-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+# Import from ikaaro
+from ikaaro.database import get_database
+from ikaaro.exceptions import ConsistencyError
+from ikaaro.folder import Folder
+from ikaaro.server import create_server, get_fake_context, get_root
+
+
+class OldBrain(object):
+    """A document of a catalog made before the links were stored.
+    """
+
+    def __init__(self, brain):
+        self.brain = brain
+
+
+    def __getattr__(self, name):
+        if name == 'links':
+            return None
+        return getattr(self.brain, name)
+
+
+
+class DelResourceTestCase(TestCase):
+
+    def setUp(self):
+        self.path = mkdtemp()
+        target = '%s/instance' % self.path
+        create_server(target, 'test@example.com', 'password', None, [])
+
+        database = get_database(target, 100, 500)
+        root = get_root(database)
+        context = get_fake_context(database, root.context_cls)
+        context.root = root
+        context.set_mtime = True
+        context.git_message = 'Test'
+        self.database = database
+        self.root = root
+
+        # /a/b is shared through /c
+        root.make_resource('a', Folder)
+        root.make_resource('a/b', Folder)
+        root.make_resource('c', Folder, share=['/a/b'])
+        database.save_changes()
+
+
+    def tearDown(self):
+        self.database.close()
+        rmtree(self.path)
+
+
+    def test_link(self):
+        self.assertRaises(ConsistencyError, self.root.del_resource, 'a/b')
+
+
+    def test_link_to_descendant(self):
+        self.assertRaises(ConsistencyError, self.root.del_resource, 'a')
+
+
+    def test_links_not_stored(self):
+        database = self.database
+        search = database.search
+        def old_search(query=None, **kw):
+            results = search(query, **kw)
+            get_documents = results.get_documents
+            results.get_documents = lambda *args, **kw: [
+                OldBrain(x) for x in get_documents(*args, **kw) ]
+            return results
+        database.search = old_search
+        self.assertRaises(ConsistencyError, self.root.del_resource, 'a')
+
+
+    def test_force(self):
+        self.root.del_resource('a', ref_action='force')
+        self.assertEqual(self.root.get_resource('a', soft=True), None)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# -*- coding: UTF-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from os import listdir
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+# Import from ikaaro
+from ikaaro.output_cache import OutputCache
+
+
+class OutputCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.path = mkdtemp()
+        self.cache = OutputCache(20, 300, '%s/output' % self.path, 20)
+
+
+    def tearDown(self):
+        rmtree(self.path)
+
+
+    def test_get(self):
+        cache = self.cache
+        etag = cache.set('a', '/a', 'text/html', 'x' * 10)
+        self.assertEqual(cache.get('a'), (etag, 'text/html', 'x' * 10))
+        self.assertEqual(cache.get('b'), None)
+
+
+    def test_disk(self):
+        cache = self.cache
+        cache.set('a', '/a', 'text/html', 'a' * 10)
+        cache.set('b', '/b', 'text/html', 'b' * 10)
+        cache.set('c', '/c', 'text/html', 'c' * 10)
+        # The least recently used page has been moved to the disk
+        self.assertEqual(cache.entries.keys(), ['b', 'c'])
+        self.assertEqual(len(listdir(cache.path)), 1)
+        # And back to memory
+        self.assertEqual(cache.get('a')[2], 'a' * 10)
+        self.assertEqual(cache.entries.keys(), ['c', 'a'])
+        self.assertEqual(cache.disk.keys(), ['b'])
+
+
+    def test_expired(self):
+        cache = self.cache
+        cache.ttl = -1
+        cache.set('a', '/a', 'text/html', 'x')
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.size, 0)
+
+
+    def test_invalidate(self):
+        cache = self.cache
+        for key in 'abc':
+            cache.set(key, '/a', 'text/html', key * 10)
+        cache.set('d', '/d', 'text/html', 'd')
+        cache.invalidate(['/a'])
+        self.assertEqual(cache.keys, {'/d': set(['d'])})
+        self.assertEqual(cache.entries.keys(), ['d'])
+        self.assertEqual(listdir(cache.path), [])
+        self.assertEqual((cache.size, cache.disk_size), (1, 0))
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+# -*- coding: UTF-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from asyncore import loop
+from os import listdir, rename
+from os.path import join
+from shutil import rmtree
+from smtpd import SMTPServer
+from smtplib import SMTPRecipientsRefused, SMTPResponseException
+from tempfile import mkdtemp
+from threading import Thread
+from time import time
+from unittest import TestCase, main
+
+# Import from ikaaro
+from ikaaro.spool import MailSpool, remove_header
+
+
+message = 'From: a@example.com\nTo: %s\nSubject: Test\n\nHello\n'
+
+
+class TestSMTPServer(SMTPServer):
+
+    def __init__(self):
+        SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.messages = []
+        self.refused = set()
+
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        for address in rcpttos:
+            if address.split('@')[1] in self.refused:
+                return '451 Try again later'
+        self.messages.append((mailfrom, rcpttos, data))
+
+
+
+class MailSpoolTestCase(TestCase):
+
+    def setUp(self):
+        self.server = TestSMTPServer()
+        thread = Thread(target=loop, kwargs={'timeout': 0.1})
+        thread.daemon = True
+        thread.start()
+        self.thread = thread
+
+        self.path = mkdtemp()
+        host = '127.0.0.1:%s' % self.server.socket.getsockname()[1]
+        self.spool = MailSpool(self.path, host, batch_size=2)
+
+
+    def tearDown(self):
+        self.spool.close()
+        self.server.close()
+        self.thread.join(1)
+        rmtree(self.path)
+
+
+    def save_bulk(self, recipients):
+        bcc = ',\n\t'.join(recipients)
+        self.spool.save('From: a@example.com\nTo: undisclosed-recipients:;\n'
+                        'Bcc: %s\nSubject: Test\n\nHello\n' % bcc)
+
+
+    def refuse(self, from_addr, to_addr, message):
+        refused = dict([ (x, (550, 'No such user')) for x in to_addr ])
+        raise SMTPRecipientsRefused(refused)
+
+
+    def reject(self, from_addr, to_addr, message):
+        raise SMTPResponseException(550, 'Rejected')
+
+
+    def test_batches(self):
+        spool = self.spool
+        for i in range(3):
+            spool.save(message % ('b%d@example.com' % i))
+        self.assertEqual(spool.get_size(), 3)
+        # First batch
+        self.assertEqual(spool.send(), 1)
+        self.assertEqual(len(self.server.messages), 2)
+        # Second batch
+        self.assertEqual(spool.send(), False)
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(spool.get_stats()['sent'], 3)
+        self.assertEqual(listdir(self.path), ['failed'])
+
+
+    def test_claimed(self):
+        spool = self.spool
+        spool.save(message % 'b@example.com')
+        name = spool.get_names()[0]
+        spool.get_names = lambda: [name, 'claimed']
+        spool.send()
+        self.assertEqual(len(self.server.messages), 1)
+
+
+    def test_bulk(self):
+        spool = self.spool
+        recipients = [ 'user%d@example.com' % i for i in range(20) ]
+        self.save_bulk(recipients)
+        self.assertEqual(spool.send(), False)
+        self.assertEqual(len(self.server.messages), 1)
+        mailfrom, rcpttos, data = self.server.messages[0]
+        self.assertEqual(rcpttos, recipients)
+        self.assertTrue('user0' not in data)
+
+
+    def test_bulk_refused(self):
+        spool = self.spool
+        spool.sendmail = self.refuse
+        self.save_bulk([ 'user%d@example.com' % i for i in range(3) ])
+        name = spool.get_names()[0]
+        self.assertEqual(spool.send(), False)
+        self.assertEqual(listdir(join(self.path, 'failed')), [name])
+        self.assertEqual(spool.get_stats()['failed'], 1)
+
+
+    def test_bulk_error(self):
+        spool = self.spool
+        spool.sendmail = self.reject
+        for i in range(2):
+            self.save_bulk(['user%d@example.com' % i])
+        names = sorted(spool.get_names())
+        self.assertEqual(spool.send(), False)
+        # Every email keeps its own name
+        failed = sorted(listdir(join(self.path, 'failed')))
+        self.assertEqual(failed, [ '550_%s' % x for x in names ])
+
+
+    def test_backoff(self):
+        spool = self.spool
+        self.server.refused.add('example.org')
+        spool.save(message % 'b@example.org')
+        spool.save(message % 'c@example.org')
+        interval = spool.send()
+        self.assertTrue(0 < interval <= spool.backoff_min)
+        # The second email to the domain is not tried
+        self.assertEqual(spool.get_stats()['deferred'], 1)
+        self.assertEqual(spool.get_size(), 2)
+        # The delay doubles
+        spool.defer('example.org', 0)
+        self.assertEqual(spool.backoff['example.org'][1],
+                         spool.backoff_min * 2)
+
+
+    def test_backoff_expired(self):
+        spool = self.spool
+        spool.backoff['example.com'] = (time() - 10, spool.backoff_min)
+        self.server.refused.add('example.org')
+        spool.save(message % 'b@example.org')
+        # Wake up when the delay of example.org expires
+        interval = spool.send()
+        self.assertTrue(1 < interval <= spool.backoff_min)
+
+
+    def test_release_locks(self):
+        spool = self.spool
+        spool.save(message % 'b@example.com')
+        name = spool.get_names()[0]
+        rename(join(self.path, name), join(self.path, '%s.lock' % name))
+        # Another spool on the same folder (e.g. a command line tool)
+        MailSpool(self.path, 'localhost')
+        self.assertEqual(spool.get_size(), 0)
+        # The server starts
+        spool.release_locks()
+        self.assertEqual(spool.get_names(), [name])
+
+
+
+class RemoveHeaderTestCase(TestCase):
+
+    def test_remove(self):
+        message = 'To: a\nBcc: b,\n c\nSubject: d\n\nBcc: e\n'
+        self.assertEqual(remove_header(message, 'Bcc'),
+                         'To: a\nSubject: d\n\nBcc: e\n')
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# -*- coding: UTF-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+# Import from ikaaro
+from ikaaro.thumbnails import ThumbnailStore
+
+
+class ThumbnailStoreTestCase(TestCase):
+
+    def setUp(self):
+        self.path = mkdtemp()
+        self.store = ThumbnailStore('%s/thumbnails' % self.path, 100)
+
+
+    def tearDown(self):
+        rmtree(self.path)
+
+
+    def test_get(self):
+        store = self.store
+        store.set('abc', 48, 48, 'png', False, ('x' * 10, 'png'))
+        self.assertEqual(store.get('abc', 48, 48, 'png', False),
+                         ('x' * 10, 'png'))
+        self.assertEqual(store.get('abc', 128, 128, 'png', False), None)
+
+
+    def test_overwrite(self):
+        store = self.store
+        for i in range(3):
+            store.set('abc', 48, 48, 'png', False, ('x' * 10, 'png'))
+        # 'png\n' + data
+        self.assertEqual(store.size, 14)
+
+
+
+if __name__ == '__main__':
+    main()
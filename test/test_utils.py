@@ -0,0 +1,207 @@
+# -*- coding: UTF-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from os import close, makedirs, remove, write
+from shutil import rmtree
+from tempfile import mkdtemp, mkstemp
+from unittest import TestCase, main
+
+# Import from itools
+from itools.fs import lfs
+from itools.handlers import RODatabase
+
+# Import from ikaaro
+from ikaaro.links import get_cached_references
+from ikaaro.utils import PathTrie, get_git_blob_id, get_git_file_blob_id
+from ikaaro.utils import get_file_blob_id, get_handler_blob_id
+from ikaaro.utils import get_handler_path
+from ikaaro.utils import get_rank_between, get_ranks, parse_http_range
+
+
+class PathTrieTestCase(TestCase):
+
+    def setUp(self):
+        trie = PathTrie()
+        trie.add('/', 'root')
+        trie.add('/config/theme', 'theme')
+        trie.add('/config/theme', 'theme2')
+        trie.add('/users', 'users')
+        self.trie = trie
+
+
+    def test_root(self):
+        matches = list(self.trie.get_matches('/'))
+        self.assertEqual(matches, [(0, 'root')])
+
+
+    def test_ancestors(self):
+        matches = list(self.trie.get_matches('/config/theme/logo'))
+        self.assertEqual(matches, [(3, 'root'), (1, 'theme'), (1, 'theme2')])
+
+
+    def test_no_match(self):
+        matches = list(self.trie.get_matches('/config/mail'))
+        self.assertEqual(matches, [(2, 'root')])
+
+
+
+class GitBlobIdTestCase(TestCase):
+
+    def test_data(self):
+        # $ printf 'hello\n' | git hash-object --stdin
+        blob_id = 'ce013625030ba8dba906f756967f9e9ca394464a'
+        self.assertEqual(get_git_blob_id('hello\n'), blob_id)
+
+
+    def test_file(self):
+        data = 'x' * 100000
+        fd, path = mkstemp()
+        try:
+            write(fd, data)
+            close(fd)
+            blob_id = get_git_file_blob_id(path, chunk_size=4096)
+        finally:
+            remove(path)
+        self.assertEqual(blob_id, get_git_blob_id(data))
+
+
+    def test_missing_file(self):
+        path = mkdtemp()
+        rmtree(path)
+        self.assertEqual(get_file_blob_id('%s/file.txt' % path), None)
+
+
+
+class HandlerTestCase(TestCase):
+
+    def setUp(self):
+        # A database whose keys are relative to its 'database' folder
+        self.path = mkdtemp()
+        path_data = '%s/database/' % self.path
+        makedirs(path_data)
+        with open('%s/file.txt' % path_data, 'w') as file:
+            file.write('hello\n')
+        database = RODatabase(fs=lfs.open(path_data))
+        database.path_data = path_data
+        self.handler = database.get_handler('file.txt')
+
+
+    def tearDown(self):
+        rmtree(self.path)
+
+
+    def test_blob_id(self):
+        handler = self.handler
+        self.assertEqual(get_handler_path(handler),
+                         '%s/database/file.txt' % self.path)
+        self.assertEqual(get_handler_blob_id(handler),
+                         get_git_blob_id('hello\n'))
+        # The blob id is computed from the file, the handler is not loaded
+        self.assertEqual(handler.timestamp, None)
+
+
+    def test_cached_references(self):
+        handler = self.handler
+        def to_str():
+            self.fail('the handler has been serialized')
+        handler.to_str = to_str
+
+        calls = []
+        def get_references(handler):
+            calls.append(handler.key)
+            return ['/a']
+        for i in range(2):
+            references = get_cached_references(handler, get_references)
+            self.assertEqual(references, ['/a'])
+        self.assertEqual(calls, ['file.txt'])
+
+
+
+class HTTPRangeTestCase(TestCase):
+
+    def test_range(self):
+        self.assertEqual(parse_http_range('bytes=0-499', 1000), (0, 499))
+        self.assertEqual(parse_http_range('bytes=900-2000', 1000), (900, 999))
+
+
+    def test_open_range(self):
+        self.assertEqual(parse_http_range('bytes=500-', 1000), (500, 999))
+
+
+    def test_suffix_range(self):
+        self.assertEqual(parse_http_range('bytes=-500', 1000), (500, 999))
+        self.assertEqual(parse_http_range('bytes=-2000', 1000), (0, 999))
+
+
+    def test_ignored(self):
+        for value in ['items=0-1', 'bytes=0-0,5-9', 'bytes=5-2', 'bytes=a-']:
+            self.assertEqual(parse_http_range(value, 1000), None)
+
+
+    def test_not_satisfiable(self):
+        self.assertRaises(ValueError, parse_http_range, 'bytes=1000-', 1000)
+        self.assertRaises(ValueError, parse_http_range, 'bytes=-0', 1000)
+
+
+
+class RankTestCase(TestCase):
+
+    def test_between(self):
+        for before, after in [(None, None), ('1', '2'), ('1', '11'),
+                              ('00z', '010'), (None, '001'), ('zz', None)]:
+            rank = get_rank_between(before, after)
+            if before is not None:
+                self.assertTrue(before < rank)
+            if after is not None:
+                self.assertTrue(rank < after)
+
+
+    def test_append(self):
+        ranks = [None]
+        for i in range(100):
+            ranks.append(get_rank_between(ranks[-1]))
+        ranks = ranks[1:]
+        self.assertEqual(ranks, sorted(ranks))
+        self.assertEqual(len(set(ranks)), 100)
+
+
+    def test_append_length(self):
+        rank = None
+        for i in range(1000):
+            rank = get_rank_between(rank)
+        self.assertEqual(len(rank), 3)
+
+
+    def test_no_room(self):
+        self.assertRaises(ValueError, get_rank_between, 'z', 'z00')
+
+
+    def test_bad_bounds(self):
+        self.assertRaises(ValueError, get_rank_between, '2', '1')
+        self.assertRaises(ValueError, get_rank_between, '1', '1')
+
+
+    def test_ranks(self):
+        ranks = get_ranks(100)
+        self.assertEqual(ranks, sorted(ranks))
+        self.assertEqual(len(set(ranks)), 100)
+        self.assertEqual(set([ len(x) for x in ranks ]), set([2]))
+        # Evenly spread
+        self.assertEqual(get_ranks(3), ['9', 'i', 'r'])
+
+
+
+if __name__ == '__main__':
+    main()